@@ -12,6 +12,18 @@ def convert_aspect_ratio_runpod(url: str):
     return call_and_poll_runpod(MODEL_ID, {"input": {"video_url": url}})
 
 
+def convert_aspect_ratio_runpod_batch(urls: list[str]) -> list:
+    """Compute the cropping boxes of several videos in a single job.
+
+    Returns:
+        list: The boxes of each url, None for videos the job failed on.
+    """
+    if not urls:
+        return []
+    output = call_and_poll_runpod(MODEL_ID, {"input": {"video_urls": urls}})
+    return output if output is not None else [None] * len(urls)
+
+
 if __name__ == "__main__":
     print(convert_aspect_ratio_runpod(
         "https://auto-shorts-storage.s3.amazonaws.com/video/e0be2e64-9edf-47da-93d6-215b0f10557d.mp4"
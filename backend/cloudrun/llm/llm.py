@@ -1,3 +1,4 @@
+import asyncio
 import os
 from typing import Optional
 from math import floor, ceil
@@ -357,7 +358,8 @@ async def get_clips_v2(segments, topic, max_clips=5):
             topic=topic, transcription=json.dumps(transcription)
         )
 
-        response = call_openai(
+        response = await asyncio.to_thread(
+            call_openai,
             prompt,
             system_prompt=MOMENT_PROMPT_V1_SYSTEM,
             model="gpt-4-1106-preview",
@@ -7,6 +7,7 @@ import random
 import uuid
 import os
 import json
+import threading
 from time import sleep
 from pathlib import Path
 
@@ -16,7 +17,9 @@ from shared.download import (
     download_youtube_audio,
     download_youtube_info,
     download_youtube_vod,
-    extract_clip_2_step_mp4,
+    download_youtube_vod_ranges,
+    extract_clip_mp4,
+    extract_clips_mp4,
     validate_youtube_url,
     extract_video_id,
     ValidationResult,
@@ -83,7 +86,7 @@ def get_secondary_video(categories: list[str]) -> SecondaryVideo:
 
 
 async def download_audio_and_upload_to_s3(url, unique_id):
-    audio_file_name = download_youtube_audio(url)
+    audio_file_name = await asyncio.to_thread(download_youtube_audio, url)
     audio_file_extension = os.path.splitext(audio_file_name)[1]
     full_audio_path = os.path.join(script_directory, audio_file_name)
     s3_object_name = f"audio/{unique_id}{audio_file_extension}"
@@ -91,10 +94,9 @@ async def download_audio_and_upload_to_s3(url, unique_id):
     # return S3_URL + s3_object_name
 
 
-async def clip_and_upload_to_s3(
-    video_path: str, unique_id: str, start: int, end: int, primary: bool
+async def upload_clip_to_s3(
+    final_output_path: str, unique_id: str, start: int, end: int, primary: bool
 ):
-    final_output_path = extract_clip_2_step_mp4(video_path, start, end)
     video_file_extension = os.path.splitext(final_output_path)[1]
     video_type = "primary" if primary else "secondary"
     s3_object_name = f"video/{unique_id}_{video_type}_{start}_{end}{video_file_extension}"
@@ -103,6 +105,22 @@ async def clip_and_upload_to_s3(
 
 CLIPS_PER_MINUTE = 1 / 5
 
+# number of clips extracted, cropped and rendered at once; a clip mostly waits on
+# ffmpeg, S3, RunPod and Remotion
+CLIP_CONCURRENCY = int(os.getenv("CLIP_CONCURRENCY", 4))
+
+# "full" downloads the whole primary video alongside transcription, "ranges" only
+# downloads the time ranges of the selected clips once they are known
+PRIMARY_DOWNLOAD_MODE = os.getenv("PRIMARY_DOWNLOAD_MODE", "full")
+
+
+def remove_file(path: str):
+    if path and os.path.isfile(path):
+        try:
+            os.remove(path)
+        except OSError as e:
+            print(f"Failed to remove {path}: {e}")
+
 
 def get_max_clips(duration: int):
     return max(int((duration / 60) * CLIPS_PER_MINUTE), 1)
@@ -160,126 +178,304 @@ async def _run(run_id: str, video_id: str, channel_id: str, is_manual: bool):
 
     unique_id = str(uuid.uuid4())
 
-    if not repurpose_run.audio_s3_url:
-        print(f"Downloading audio for {primary_url}")
-        audio_s3_url = await download_audio_and_upload_to_s3(primary_url, unique_id)
-
-        with get_db_context_manager() as db:
-            repurpose_run.audio_s3_url = audio_s3_url
-            db.add(repurpose_run)
-            db.commit()
-            db.refresh(repurpose_run)
-
-    if repurpose_run.audio_segments is None:
-        print(f"Transcribing audio for {primary_url}: {repurpose_run.audio_s3_url}")
-        segments = await transcribe_audio(audio_s3_url)
-
-        with get_db_context_manager() as db:
-            repurpose_run.audio_segments = [segment.model_dump() for segment in segments]
-            db.add(repurpose_run)
-            db.commit()
-            db.refresh(repurpose_run)
-    else:
-        segments = [TranscriptionSegment(**segment) for segment in repurpose_run.audio_segments]
-
-    if segments is None:
-        send_slack_message(f"Failed to transcribe audio for {primary_url}: {audio_s3_url}")
-        return False
-
-    if len(segments) == 0:
-        send_slack_message(f"No audio segments found for {primary_url}: {audio_s3_url}")
-        return True
+    # a run that leaves before the download is done abandons it, the download thread
+    # can't be stopped so it removes the file itself once it is done
+    primary_download_state = {"done": False, "abandoned": False}
+    primary_download_lock = threading.Lock()
 
-    if repurpose_run.clips is None:
-        print(f"Getting clips for {primary_url}: {clip_topic}")
-        clips = await get_clips_v2(
-            segments, clip_topic, max_clips=get_max_clips(segments[-1].end - segments[0].start)
+    def download_primary_video():
+        primary_file_name = None
+        try:
+            primary_file_name = download_youtube_vod(
+                primary_url, resolution=1080, ext="mp4"
+            )
+            return primary_file_name
+        finally:
+            with primary_download_lock:
+                primary_download_state["done"] = True
+                abandoned = primary_download_state["abandoned"]
+            if abandoned and primary_file_name:
+                remove_file(os.path.join(script_directory, primary_file_name))
+
+    primary_download = None
+    if PRIMARY_DOWNLOAD_MODE == "full":
+        # the clips are only cut after transcription and clip selection, so download
+        # the primary video alongside them
+        print(f"Downloading primary video: {primary_url}")
+        primary_download = asyncio.create_task(
+            asyncio.to_thread(download_primary_video)
         )
 
-        print(f"Found {len(clips)} clips for {primary_url}: {clip_topic}")
+    # the clip extraction reads the downloaded video; the downloaded sections and the
+    # cut clips are removed once the run is done
+    clip_extraction = None
+    sections = []
+    clip_paths = set()
+    try:
+        if not repurpose_run.audio_s3_url:
+            print(f"Downloading audio for {primary_url}")
+            audio_s3_url = await download_audio_and_upload_to_s3(primary_url, unique_id)
 
-        with get_db_context_manager() as db:
-            repurpose_run.clips = clips
-            db.add(repurpose_run)
-            db.commit()
-            db.refresh(repurpose_run)
+            with get_db_context_manager() as db:
+                repurpose_run.audio_s3_url = audio_s3_url
+                db.add(repurpose_run)
+                db.commit()
+                db.refresh(repurpose_run)
 
-    if not repurpose_run.clips:
-        send_slack_message(f"No clips found for {primary_url}: {clip_topic}")
-        print(f"No clips found for {primary_url}: {clip_topic}")
-        return True
+        if repurpose_run.audio_segments is None:
+            print(f"Transcribing audio for {primary_url}: {repurpose_run.audio_s3_url}")
+            segments = await transcribe_audio(repurpose_run.audio_s3_url)
 
-    print(f"Downloading primary video: {primary_url}")
-    primary_file_name = download_youtube_vod(primary_url, resolution=1080, ext="mp4")
-    if not primary_file_name:
-        send_slack_message(f"Failed to download primary video: {primary_url}")
-        return False
+            with get_db_context_manager() as db:
+                repurpose_run.audio_segments = [segment.model_dump() for segment in segments]
+                db.add(repurpose_run)
+                db.commit()
+                db.refresh(repurpose_run)
+        else:
+            segments = [TranscriptionSegment(**segment) for segment in repurpose_run.audio_segments]
 
-    full_primary_file_path = os.path.join(script_directory, primary_file_name)
+        if segments is None:
+            send_slack_message(
+                f"Failed to transcribe audio for {primary_url}: {repurpose_run.audio_s3_url}"
+            )
+            return False
 
-    subtitle_segments = break_up_segments_for_subtitles(segments)
+        if len(segments) == 0:
+            send_slack_message(
+                f"No audio segments found for {primary_url}: {repurpose_run.audio_s3_url}"
+            )
+            return True
 
-    def get_clip_key(clip):
-        return str(clip["start"]) + "_" + str(clip["end"])
+        if repurpose_run.clips is None:
+            print(f"Getting clips for {primary_url}: {clip_topic}")
+            clips = await get_clips_v2(
+                segments, clip_topic, max_clips=get_max_clips(segments[-1].end - segments[0].start)
+            )
 
-    for clip in clips:
-        print(
-            f"Clipping primary video from {clip['start']} to {clip['end']}: {full_primary_file_path}"
-        )
-        clip_segments = get_segments_for_clip(subtitle_segments, clip["start"], clip["end"])
+            print(f"Found {len(clips)} clips for {primary_url}: {clip_topic}")
 
-        primary_s3_url = repurpose_run.clip_primary_urls.get(get_clip_key(clip))
-        if not primary_s3_url:
-            primary_s3_url = await clip_and_upload_to_s3(
-                full_primary_file_path, unique_id, clip["start"], clip["end"], True
-            )
             with get_db_context_manager() as db:
-                repurpose_run.clip_primary_urls = {
-                    **repurpose_run.clip_primary_urls,
-                    get_clip_key(clip): primary_s3_url,
-                }
+                repurpose_run.clips = clips
                 db.add(repurpose_run)
                 db.commit()
                 db.refresh(repurpose_run)
 
-        secondary_video = get_secondary_video(secondary_categories)
+        clips = repurpose_run.clips
+        if not clips:
+            send_slack_message(f"No clips found for {primary_url}: {clip_topic}")
+            print(f"No clips found for {primary_url}: {clip_topic}")
+            return True
+
+        def get_clip_key(clip):
+            return str(clip["start"]) + "_" + str(clip["end"])
+
+        missing_clips = [
+            clip for clip in clips if not repurpose_run.clip_primary_urls.get(get_clip_key(clip))
+        ]
+        # futures of the clips cut out of the full primary video, and the file and its
+        # start time in the primary video of the clips cut out of downloaded ranges
+        extracted_clips = {}
+        clip_sources = {}
+        if primary_download:
+            primary_file_name = await primary_download
+            if not primary_file_name:
+                send_slack_message(f"Failed to download primary video: {primary_url}")
+                return False
+
+            full_primary_file_path = os.path.join(script_directory, primary_file_name)
+
+            # every clip is cut in a single ffmpeg pass, and moves on to its upload as soon
+            # as it is done
+            loop = asyncio.get_running_loop()
+            extracted_clips = {get_clip_key(clip): loop.create_future() for clip in missing_clips}
+
+            def set_clip_path(future, clip_path):
+                if clip_path:
+                    clip_paths.add(clip_path)
+                # identical clips share a future
+                if not future.done():
+                    future.set_result(clip_path)
+
+            def on_clip_extracted(index, clip_path):
+                # called from the extraction thread
+                future = extracted_clips[get_clip_key(missing_clips[index])]
+                loop.call_soon_threadsafe(set_clip_path, future, clip_path)
+
+            if missing_clips:
+                print(f"Clipping primary video: {full_primary_file_path}: {missing_clips}")
+                clip_extraction = asyncio.create_task(
+                    asyncio.to_thread(
+                        extract_clips_mp4,
+                        full_primary_file_path,
+                        [(clip["start"], clip["end"]) for clip in missing_clips],
+                        on_clip=on_clip_extracted,
+                    )
+                )
+
+                def fail_unextracted_clips(task):
+                    # an extraction that raised leaves its remaining clips unreported
+                    for future in extracted_clips.values():
+                        if not future.done():
+                            future.set_result(None)
+
+                clip_extraction.add_done_callback(fail_unextracted_clips)
+        elif missing_clips:
+            print(f"Downloading primary video ranges: {primary_url}: {missing_clips}")
+            sections = await asyncio.to_thread(
+                download_youtube_vod_ranges,
+                primary_url,
+                [(clip["start"], clip["end"]) for clip in missing_clips],
+                resolution=1080,
+                ext="mp4",
+            )
+            if not sections:
+                send_slack_message(f"Failed to download primary video: {primary_url}")
+                return False
 
-        portrait_scene_boxes = repurpose_run.clip_bounding_boxes.get(get_clip_key(clip))
-        if not portrait_scene_boxes:
-            print(f"Calculating bounding boxes for {primary_url}: {clip}")
-            portrait_scene_boxes = convert_aspect_ratio_runpod(primary_s3_url)
+            clip_sources = {
+                get_clip_key(clip): section
+                for clip, section in zip(missing_clips, sections)
+                if section
+            }
+
+        subtitle_segments = break_up_segments_for_subtitles(segments)
 
+        def save_clip_value(field, clip, value):
+            # runs on the event loop between awaits, so concurrent clips never overwrite
+            # each other's entries
             with get_db_context_manager() as db:
-                repurpose_run.clip_bounding_boxes = {
-                    **repurpose_run.clip_bounding_boxes,
-                    get_clip_key(clip): portrait_scene_boxes,
-                }
+                setattr(
+                    repurpose_run,
+                    field,
+                    {**getattr(repurpose_run, field), get_clip_key(clip): value},
+                )
                 db.add(repurpose_run)
                 db.commit()
                 db.refresh(repurpose_run)
 
-        if not portrait_scene_boxes:
-            print(f"Failed to calculate bounding boxes for {primary_url}: {clip}")
-            continue
-
-        print(f"Rendering video for {primary_url}: {clip}")
-        render_info = render_short(
-            primary_url=primary_s3_url,
-            secondary_url=secondary_video.s3_url,
-            durationInSeconds=clip["end"] - clip["start"],
-            segments=[cs.model_dump() for cs in clip_segments],
-            cropping_boxes=portrait_scene_boxes,
-            video_id=video_id,
-            channel_id=channel_id,
-            repurposer_id=repurpose_run.repurposer_id,
-            run_id=run_id,
-        )
-        print(
-            f"Rendering initiated for video: {primary_url}: {clip}, render info: {render_info}"
-        )
-        send_slack_message(f"Rendering initiated for video: {primary_url}: {clip}")
+        async def upload_clip(clip):
+            primary_s3_url = repurpose_run.clip_primary_urls.get(get_clip_key(clip))
+            if primary_s3_url:
+                return primary_s3_url
+
+            clip_path = None
+            if get_clip_key(clip) in extracted_clips:
+                clip_path = await extracted_clips[get_clip_key(clip)]
+            elif get_clip_key(clip) in clip_sources:
+                source_path, source_offset = clip_sources[get_clip_key(clip)]
+                print(
+                    f"Clipping primary video from {clip['start']} to {clip['end']}: {source_path}"
+                )
+                clip_path = await asyncio.to_thread(
+                    extract_clip_mp4,
+                    source_path,
+                    clip["start"] - source_offset,
+                    clip["end"] - source_offset,
+                )
+                if clip_path:
+                    clip_paths.add(clip_path)
+
+            if not clip_path:
+                print(f"Failed to clip primary video for {primary_url}: {clip}")
+                return None
+
+            primary_s3_url = await upload_clip_to_s3(
+                clip_path, unique_id, clip["start"], clip["end"], True
+            )
+            save_clip_value("clip_primary_urls", clip, primary_s3_url)
+            return primary_s3_url
 
-    return True
+        async def score_clip(clip, primary_s3_url):
+            portrait_scene_boxes = repurpose_run.clip_bounding_boxes.get(get_clip_key(clip))
+            if portrait_scene_boxes:
+                return portrait_scene_boxes
+
+            print(f"Calculating bounding boxes for {primary_url}: {clip}")
+            portrait_scene_boxes = await asyncio.to_thread(
+                convert_aspect_ratio_runpod, primary_s3_url
+            )
+            if portrait_scene_boxes:
+                save_clip_value("clip_bounding_boxes", clip, portrait_scene_boxes)
+            return portrait_scene_boxes
+
+        async def render_clip(clip, primary_s3_url, portrait_scene_boxes):
+            if not portrait_scene_boxes:
+                print(f"Failed to calculate bounding boxes for {primary_url}: {clip}")
+                return False
+
+            clip_segments = get_segments_for_clip(subtitle_segments, clip["start"], clip["end"])
+            secondary_video = get_secondary_video(secondary_categories)
+
+            print(f"Rendering video for {primary_url}: {clip}")
+            render_info = await asyncio.to_thread(
+                render_short,
+                primary_url=primary_s3_url,
+                secondary_url=secondary_video.s3_url,
+                durationInSeconds=clip["end"] - clip["start"],
+                segments=[cs.model_dump() for cs in clip_segments],
+                cropping_boxes=portrait_scene_boxes,
+                video_id=video_id,
+                channel_id=channel_id,
+                repurposer_id=repurpose_run.repurposer_id,
+                run_id=run_id,
+            )
+            print(
+                f"Rendering initiated for video: {primary_url}: {clip}, render info: {render_info}"
+            )
+            send_slack_message(f"Rendering initiated for video: {primary_url}: {clip}")
+            return True
+
+        async def process_clip(clip):
+            primary_s3_url = await upload_clip(clip)
+            if not primary_s3_url:
+                return False
+
+            portrait_scene_boxes = await score_clip(clip, primary_s3_url)
+            return await render_clip(clip, primary_s3_url, portrait_scene_boxes)
+
+        semaphore = asyncio.Semaphore(CLIP_CONCURRENCY)
+
+        async def try_process_clip(clip):
+            # a failing clip is reported and skipped, the other clips carry on
+            async with semaphore:
+                try:
+                    return await process_clip(clip)
+                except Exception as e:
+                    stack_trace = traceback.format_exc()
+                    send_slack_message(
+                        f"Failed to process clip {clip} for {primary_url}: {e}\nStack trace:\n{stack_trace}"
+                    )
+                    return False
+
+        await asyncio.gather(*[try_process_clip(clip) for clip in clips])
+        return True
+    finally:
+        # the download and extraction run on threads that can't be cancelled; an early
+        # exit abandons a download still running, the extraction is waited for since it
+        # reads the full video
+        primary_file_name = None
+        if primary_download:
+            with primary_download_lock:
+                primary_download_state["abandoned"] = not primary_download_state["done"]
+            if primary_download_state["abandoned"]:
+                primary_download.cancel()
+            else:
+                try:
+                    primary_file_name = await primary_download
+                except Exception as e:
+                    print(f"Failed to download primary video: {primary_url}: {e}")
+        if clip_extraction:
+            try:
+                await clip_extraction
+            except Exception as e:
+                print(f"Failed to clip primary video: {primary_url}: {e}")
+        if primary_file_name:
+            remove_file(os.path.join(script_directory, primary_file_name))
+        for section in sections or []:
+            if section:
+                remove_file(section[0])
+        for clip_path in clip_paths:
+            remove_file(clip_path)
 
 
 #     access_token = get_access_token_for_youtube(REFRESH_TOKEN)
@@ -2,6 +2,7 @@
 
 # load_dotenv()
 
+import asyncio
 import os
 from time import sleep
 
@@ -173,7 +174,7 @@ async def transcribe_audio(audio_s3_url: str):
     body = WhisperBody(
         input=WhisperInput(audio=audio_s3_url, transcription=None, word_timestamps=True)
     )
-    output = call_and_poll_runpod(MODEL_ID, body.dict())
+    output = await asyncio.to_thread(call_and_poll_runpod, MODEL_ID, body.dict())
     if output:
         return parse_whisper_output(output)
 
@@ -0,0 +1,367 @@
+"""Throughput benchmark of the saliency crop pipeline.
+
+Generates synthetic videos with ffmpeg (a moving object, hard cuts and a static shot),
+then times every stage of the pipeline separately and the full
+`compute_portrait_square_bboxes_with_scenes` call on them and on any reference videos:
+
+    python -m aspect_ratio.benchmark --output baseline.json video1.mp4 ...
+
+Compare against an earlier report, exiting with status 1 when a stage got slower or the
+boxes drifted:
+
+    python -m aspect_ratio.benchmark --baseline baseline.json video1.mp4 ...
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+from collections import defaultdict
+from tempfile import gettempdir
+
+import numpy as np
+import torch
+
+from aspect_ratio.conversion import (
+    ENGINES,
+    PRECISIONS,
+    _finalize_scene_centroids,
+    _scene_clips,
+    compute_highest_intensity_component,
+    compute_portrait_square_bboxes_with_scenes,
+    decode_frames_with_scenes,
+    device,
+    get_info,
+    is_traced_model,
+    load_tased_model,
+    prefetch_frames,
+    process_batch,
+)
+from aspect_ratio.instrumentation import StageStats
+
+
+STAGES = (
+    "probe",
+    "scene_detect",
+    "decode",
+    "inference",
+    "component_scoring",
+    "smoothing",
+    "pipeline",
+)
+
+# lavfi inputs and filter graph of every synthetic video, for a given size and duration
+SYNTHETIC_VIDEOS = {
+    "moving": (
+        ["color=c=black:s={size}:r=30:d={duration}", "color=c=white:s=96x96:r=30"],
+        "[0][1]overlay=x='(W-w)*(0.5+0.45*sin(t))':y='(H-h)*(0.5+0.3*cos(t/2))'"
+        ":shortest=1",
+    ),
+    "cuts": (
+        [
+            "testsrc2=s={size}:r=30:d={third}",
+            "smptebars=s={size}:r=30:d={third}",
+            "mandelbrot=s={size}:r=30,trim=duration={third}",
+        ],
+        "[0][1][2]concat=n=3:v=1",
+    ),
+    "static": (
+        ["smptebars=s={size}:r=30:d={duration}"],
+        "[0]noise=alls=8:allf=t",
+    ),
+}
+
+
+def generate_videos(directory, size="1280x720", duration=10):
+    """Render the synthetic videos with ffmpeg, reusing ones that already exist.
+
+    Returns:
+        list: The paths of the videos.
+    """
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for name, (sources, graph) in SYNTHETIC_VIDEOS.items():
+        path = os.path.join(directory, f"{name}_{size}_{duration}s.mp4")
+        paths.append(path)
+        if os.path.isfile(path):
+            continue
+
+        cmd = ["ffmpeg", "-v", "error", "-y"]
+        for source in sources:
+            source = source.format(size=size, duration=duration, third=duration / 3)
+            cmd += ["-f", "lavfi", "-i", source]
+        cmd += ["-filter_complex", graph + "[v]", "-map", "[v]"]
+        cmd += ["-c:v", "libx264", "-pix_fmt", "yuv420p", path]
+        subprocess.run(cmd, check=True)
+    return paths
+
+
+def stage_report(stages, num_frames):
+    """Add the throughput in frames per second to the `StageStats` entries of a video."""
+    return {
+        stage: {
+            **stages[stage],
+            "fps": num_frames / max(stages[stage]["wall_seconds"], 1e-9),
+        }
+        for stage in STAGES
+        if stage in stages
+    }
+
+
+def benchmark_video(
+    video_path,
+    model,
+    step_size=32,
+    temporal_len=32,
+    batch_size=4,
+    precision="fp32",
+    skip_threshold=0.0,
+    num_workers=1,
+    coarse_size=None,
+    scene_frame_skip=0,
+):
+    """Time every stage of the pipeline on a video, then the full pipeline.
+
+    The stages run one after the other on their own: decoding is timed on its own
+    pass without scene detection, and inference and component scoring are timed on a
+    second pass whose decoding is not counted. Scene detection runs in-line on that
+    second pass with `scene_frame_skip`, the way the pipeline runs it, and only the
+    detector is counted.
+
+    Returns:
+        dict: The frame count, per-stage timings and boxes of the full pipeline.
+    """
+    import decord
+
+    decord.bridge.set_bridge("torch")
+    stage_stats = StageStats()
+
+    with stage_stats.measure("probe"):
+        info = get_info(video_path)
+    num_frames = info.get("num_frames", 0)
+    fps = info.get("fps", 30)
+
+    def open_reader():
+        return decord.VideoReader(
+            video_path, ctx=decord.cpu(), width=384, height=224, num_threads=0
+        )
+
+    with stage_stats.measure("decode"):
+        for _ in prefetch_frames(open_reader()):
+            pass
+
+    clips = torch.empty((batch_size, 3, temporal_len, 224, 384))
+    scenes = []
+    scene_centroids = defaultdict(list)
+
+    def score(scene_nums, num_clips):
+        with stage_stats.measure("inference"):
+            smaps = process_batch(
+                model, clips[:num_clips], precision=precision, input_size=coarse_size
+            )
+        with stage_stats.measure("component_scoring"):
+            for scene_num, smap in zip(scene_nums, smaps):
+                scene_centroids[scene_num].append(
+                    compute_highest_intensity_component(smap)
+                )
+
+    # the decoding of this pass is measured too, but only scene detection is reported
+    detect_stats = StageStats()
+    reader = open_reader()
+    frames = decode_frames_with_scenes(
+        reader,
+        reader.get_avg_fps(),
+        stage_stats=detect_stats,
+        frame_skip=scene_frame_skip,
+    )
+    scene_nums = []
+    windows = _scene_clips(
+        frames, scenes, step_size=step_size, temporal_len=temporal_len
+    )
+    for scene_num, window in windows:
+        window.write_clip(clips[len(scene_nums)])
+        scene_nums.append(scene_num)
+        if len(scene_nums) == batch_size:
+            score(scene_nums, batch_size)
+            scene_nums = []
+    if scene_nums:
+        score(scene_nums, len(scene_nums))
+    if "scene_detect" in detect_stats.stages:
+        stage_stats.merge({"scene_detect": detect_stats.stages["scene_detect"]})
+
+    with stage_stats.measure("smoothing"):
+        for scene_num, (start_frame, end_frame) in enumerate(scenes):
+            _finalize_scene_centroids(
+                scene_centroids[scene_num],
+                end_frame - start_frame,
+                start_frame / fps,
+                fps,
+                step_size=step_size,
+            )
+
+    with stage_stats.measure("pipeline"):
+        boxes = compute_portrait_square_bboxes_with_scenes(
+            video_path,
+            model=model,
+            step_size=step_size,
+            temporal_len=temporal_len,
+            batch_size=batch_size,
+            precision=precision,
+            skip_threshold=skip_threshold,
+            num_workers=num_workers,
+            coarse_size=coarse_size,
+            scene_frame_skip=scene_frame_skip,
+        )
+
+    return {
+        "frames": num_frames,
+        "scenes": len(scenes),
+        "stages": stage_report(stage_stats.stages, num_frames),
+        # JSON turns the BBox tuples into lists anyway
+        "boxes": json.loads(json.dumps(boxes)),
+    }
+
+
+def box_drift(boxes, baseline_boxes):
+    """Largest difference between two sets of boxes, in seconds or normalized units.
+
+    Returns:
+        float: inf if the number of boxes differs.
+    """
+    drift = 0.0
+    for output, baseline_output in zip(boxes, baseline_boxes):
+        if len(output) != len(baseline_output):
+            return float("inf")
+        for box, baseline_box in zip(output, baseline_output):
+            values = np.array([box[0], box[1], *box[2]], dtype=np.float64)
+            baseline_values = np.array(
+                [baseline_box[0], baseline_box[1], *baseline_box[2]], dtype=np.float64
+            )
+            drift = max(drift, float(np.abs(values - baseline_values).max()))
+    return drift
+
+
+def compare_reports(
+    report, baseline, max_slowdown=0.2, box_tolerance=0.01, min_seconds=0.5
+):
+    """List the regressions of a report against a baseline report.
+
+    Stages that took less than `min_seconds` in the baseline are too noisy to compare
+    and are skipped. Videos missing from either report are ignored.
+
+    Returns:
+        list: A description of every regression, empty if there are none.
+    """
+    failures = []
+    for name, video in report["videos"].items():
+        baseline_video = baseline["videos"].get(name)
+        if baseline_video is None:
+            continue
+
+        for stage, timing in video["stages"].items():
+            baseline_timing = baseline_video["stages"].get(stage)
+            if baseline_timing is None or baseline_timing["wall_seconds"] < min_seconds:
+                continue
+            if timing["fps"] < baseline_timing["fps"] * (1 - max_slowdown):
+                failures.append(
+                    f"{name} {stage}: {timing['fps']:.1f} fps, "
+                    f"baseline {baseline_timing['fps']:.1f} fps"
+                )
+
+        drift = box_drift(video["boxes"], baseline_video["boxes"])
+        if drift > box_tolerance:
+            failures.append(f"{name} boxes drifted by {drift:.4f}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("videos", nargs="*", help="reference videos to benchmark")
+    parser.add_argument(
+        "--synthetic-dir", default=os.path.join(gettempdir(), "saliency_benchmark")
+    )
+    parser.add_argument("--no-synthetic", action="store_true")
+    parser.add_argument("--size", default="1280x720")
+    parser.add_argument("--duration", type=int, default=10)
+    parser.add_argument("--engine", choices=ENGINES, default="eager")
+    parser.add_argument("--precision", choices=PRECISIONS, default="fp32")
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--skip-threshold", type=float, default=0.0)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument(
+        "--coarse-size", help="WIDTHxHEIGHT to score windows at before refining them"
+    )
+    parser.add_argument(
+        "--scene-frame-skip",
+        type=int,
+        default=0,
+        help="frames the scene detector skips after every frame it sees",
+    )
+    parser.add_argument("--output", help="write the report as JSON to this path")
+    parser.add_argument("--baseline", help="report to compare against")
+    parser.add_argument("--max-slowdown", type=float, default=0.2)
+    parser.add_argument("--box-tolerance", type=float, default=0.01)
+    parser.add_argument("--min-seconds", type=float, default=0.5)
+    args = parser.parse_args()
+
+    video_paths = list(args.videos)
+    if not args.no_synthetic:
+        video_paths += generate_videos(
+            args.synthetic_dir, size=args.size, duration=args.duration
+        )
+
+    model = load_tased_model(device, engine=args.engine, precision=args.precision)
+    coarse_size = None
+    if args.coarse_size:
+        width, height = args.coarse_size.split("x")
+        coarse_size = (int(height), int(width))
+    if coarse_size is not None and is_traced_model(model):
+        # traced graphs only accept the 384x224 windows they were traced with
+        print("Coarse scoring needs the eager model, scoring every window at 384x224")
+        coarse_size = None
+    report = {"settings": vars(args), "videos": {}}
+    for video_path in video_paths:
+        name = os.path.basename(video_path)
+        print(f"benchmarking {name}")
+        report["videos"][name] = benchmark_video(
+            video_path,
+            model,
+            batch_size=args.batch_size,
+            precision=args.precision,
+            skip_threshold=args.skip_threshold,
+            num_workers=args.workers,
+            coarse_size=coarse_size,
+            scene_frame_skip=args.scene_frame_skip,
+        )
+
+    print(f"{'video':<32} {'stage':<18} {'seconds':>8} {'fps':>8} {'peak MB':>8}")
+    for name, video in report["videos"].items():
+        for stage, timing in video["stages"].items():
+            print(
+                f"{name:<32} {stage:<18} {timing['wall_seconds']:>8.2f} "
+                f"{timing['fps']:>8.1f} {timing['peak_rss_mb']:>8.0f}"
+            )
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=4)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        failures = compare_reports(
+            report,
+            baseline,
+            max_slowdown=args.max_slowdown,
+            box_tolerance=args.box_tolerance,
+            min_seconds=args.min_seconds,
+        )
+        for failure in failures:
+            print(f"REGRESSION {failure}")
+        if failures:
+            sys.exit(1)
+        print("no regressions")
+
+
+if __name__ == "__main__":
+    main()
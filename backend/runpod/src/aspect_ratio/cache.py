@@ -0,0 +1,94 @@
+"""Content-addressed on-disk cache for saliency results.
+
+Entries are keyed by a hash of the video file plus a version hash of the model and
+parameters that produced them, so a result is reused for any copy of the same clip and
+invalidated whenever the model or parameters change. The directory can live on local
+disk or on a volume shared between workers.
+"""
+import hashlib
+import json
+import os
+from tempfile import NamedTemporaryFile
+from typing import Any, Optional
+
+
+def file_digest(path, chunk_size=1 << 20) -> str:
+    """SHA-256 hex digest of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def result_version(**params) -> str:
+    """Short hash identifying the model and parameters a result was computed with."""
+    encoded = json.dumps(params, sort_keys=True, default=str).encode()
+    return hashlib.sha256(encoded).hexdigest()[:16]
+
+
+class SaliencyCache:
+    """JSON results on disk with least-recently-used eviction.
+
+    Reads refresh an entry's modification time, and writes evict the least recently
+    used entries until the directory fits in `max_bytes`.
+    """
+
+    def __init__(self, directory, max_bytes=1 << 30):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, video_path, version: str) -> str:
+        return f"{file_digest(video_path)}-{version}"
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + ".json")
+
+    def get(self, key: str) -> Optional[Any]:
+        path = self._path(key)
+        try:
+            with open(path) as file:
+                value = json.load(file)
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            print(f"Removing corrupt cache entry: {path}")
+            os.remove(path)
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            # e.g. a read-only volume, the entry just isn't marked as recently used
+            pass
+        return value
+
+    def put(self, key: str, value: Any):
+        # write to a temporary file first so readers never see a partial entry
+        with NamedTemporaryFile(
+            "w", dir=self.directory, suffix=".tmp", delete=False
+        ) as file:
+            json.dump(value, file)
+        os.replace(file.name, self._path(key))
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(".json"):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total_bytes = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_bytes -= size
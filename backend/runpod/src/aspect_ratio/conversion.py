@@ -11,25 +11,58 @@ from typing import (
     Tuple,
     Union,
 )
-from collections import namedtuple
+from collections import defaultdict, deque, namedtuple
+import copy
 import itertools
+import queue
+import threading
 
 import cv2
 import ffmpeg
 import imageio
 import numpy as np
-from scenedetect import AdaptiveDetector, FrameTimecode, detect
+from scenedetect import (
+    AdaptiveDetector,
+    FrameTimecode,
+    SceneManager,
+    detect,
+    open_video,
+)
 from scipy.ndimage import gaussian_filter
 from scipy.signal import medfilt
-from scipy.spatial.distance import cdist
 import torch
+import torch.nn.functional as F
 from tqdm import tqdm
 
-from aspect_ratio.tased_net import TASED_v2
+from aspect_ratio.instrumentation import StageStats, measure
+from aspect_ratio.smoothing import compute_smoothed_centroids, upsample_centroids
+from aspect_ratio.tased_net import TASED_v2, fuse_for_inference
 
 
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
+# inference engines supported by load_tased_model
+ENGINES = ("eager", "torchscript")
+
+# numerical precisions supported by load_tased_model and process_batch
+PRECISIONS = ("fp32", "bf16", "int8")
+
+TASED_WEIGHT_FILE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "TASED_updated.pt"
+)
+# statically quantized model written by aspect_ratio.quantization
+TASED_INT8_WEIGHT_FILE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "TASED_int8.pt"
+)
+# name-normalized state dict written by convert_tased_weights, loaded memory-mapped
+TASED_FAST_WEIGHT_FILE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "TASED_fast.pt"
+)
+
+# maximum absolute difference allowed between the saliency maps (in [0, 1]) of the
+# eager model and a compiled engine before falling back to the eager model
+ENGINE_ATOL = 1e-4
+
 
 def get_info(
     filename: Union[str, os.PathLike],
@@ -74,8 +107,83 @@ def get_info(
     }
 
 
+def _largest_change(frames):
+    """Find the frame of an (N, H, W, 3) stack that differs most from the one before it.
+
+    Returns:
+        int: Its index, from 1 to N - 1.
+    """
+    differences = np.abs(np.diff(frames.astype(np.int16), axis=0)).mean(axis=(1, 2, 3))
+    return 1 + int(np.argmax(differences))
+
+
+def _refine_cut(reader, start, end):
+    """Find the frame in `start + 1..end` that differs most from the frame before it."""
+    frames = reader.get_batch(list(range(start, end + 1))).numpy()
+    return start + _largest_change(frames)
+
+
+def detect_cuts_fast(
+    video_path, min_scene_time=1, frame_skip=0, min_width=128, show_progress=False
+):
+    """Detect scene cuts on downscaled and optionally skipped frames.
+
+    The `AdaptiveDetector` only sees every `frame_skip + 1`th frame, downscaled to about
+    `min_width` pixels wide; skipped frames are grabbed without being converted. A cut
+    it finds lies somewhere after the previous frame it saw, so the frames in between
+    are decoded and the cut moved onto the largest frame-to-frame change. The minimum
+    scene length is only enforced on the refined cuts, since a skipped cut can be
+    reported up to `frame_skip` frames late.
+
+    Args:
+        video_path (str): Path to the video file.
+        min_scene_time (int): Minimum length of a scene in seconds.
+        frame_skip (int): Number of frames skipped after every frame the detector sees.
+        min_width (int): Width the frames are downscaled to, at least.
+        show_progress (bool): Whether to show progress bar.
+
+    Returns:
+        tuple: (cuts, fps, num_frames) with the frame number of every cut, in order, and
+            the frame rate and length of the video as probed when opening it.
+    """
+    video = open_video(video_path)
+    fps = video.frame_rate
+    num_frames = video.duration.get_frames()
+
+    scene_manager = SceneManager()
+    scene_manager.auto_downscale = False
+    scene_manager.downscale = max(video.frame_size[0] // min_width, 1)
+    scene_manager.add_detector(AdaptiveDetector(min_scene_len=0))
+    scene_manager.detect_scenes(
+        video, frame_skip=frame_skip, show_progress=show_progress
+    )
+    cuts = [start.get_frames() for start, _ in scene_manager.get_scene_list()[1:]]
+
+    if frame_skip > 0 and cuts:
+        import decord
+
+        decord.bridge.set_bridge("torch")
+        reader = decord.VideoReader(
+            video_path, ctx=decord.cpu(), width=384, height=224, num_threads=0
+        )
+        cuts = [_refine_cut(reader, max(cut - frame_skip - 1, 0), cut) for cut in cuts]
+
+    # like the detector, keep the first cut and those far enough from the last one kept
+    min_scene_len = fps * min_scene_time
+    kept_cuts = []
+    for cut in cuts:
+        if not kept_cuts or cut - kept_cuts[-1] >= min_scene_len:
+            kept_cuts.append(cut)
+    return kept_cuts, fps, num_frames
+
+
 def detect_scenes(
-    video_path, min_scene_time=1, show_progress=False, include_last_scene=False
+    video_path,
+    min_scene_time=1,
+    show_progress=False,
+    include_last_scene=False,
+    fast=False,
+    frame_skip=0,
 ):
     """Detect scenes in a video.
 
@@ -84,22 +192,42 @@ def detect_scenes(
         min_scene_time (int): Minimum length of a scene in seconds.
         show_progress (bool): Whether to show progress bar.
         include_last_scene (bool): Whether to include the last scene in the video.
+        fast (bool): Whether to detect cuts on smaller, optionally skipped frames (see
+            `detect_cuts_fast`) instead of with PySceneDetect's defaults.
+        frame_skip (int): In fast mode, the number of frames skipped after every frame
+            the detector sees. Cuts are refined back to the exact frame.
     Returns:
         list: List of scenes in the video.
 
     Note: if 0 scenes are detected, the entire video is returned as a scene.
 
     """
-    fps = get_info(video_path).get("fps", 30)
-    scenes = detect(
-        video_path,
-        AdaptiveDetector(min_scene_len=fps * min_scene_time),
-        show_progress=show_progress,
-    )
-    if include_last_scene:
+    if fast:
+        cuts, fps, num_frames = detect_cuts_fast(
+            video_path,
+            min_scene_time=min_scene_time,
+            frame_skip=frame_skip,
+            show_progress=show_progress,
+        )
+        info = {"fps": fps, "num_frames": num_frames}
+        # like `detect`, a video without cuts has no scenes
+        boundaries = [0] + cuts + [num_frames] if cuts else []
+        scenes = [
+            (FrameTimecode(start, fps), FrameTimecode(end, fps))
+            for start, end in zip(boundaries, boundaries[1:])
+        ]
+    else:
+        info = get_info(video_path)
+        fps = info.get("fps", 30)
+        scenes = detect(
+            video_path,
+            AdaptiveDetector(min_scene_len=fps * min_scene_time),
+            show_progress=show_progress,
+        )
+    if include_last_scene and scenes:
         prev_last_scene = scenes[-1]
         prev_last_frame = prev_last_scene[-1].get_frames()
-        last_video_frame = get_info(video_path).get("num_frames", prev_last_frame)
+        last_video_frame = info.get("num_frames", prev_last_frame)
         print(f"prev last frame: {prev_last_frame}")
         print(f"last video frame: {last_video_frame}")
         if prev_last_frame != last_video_frame:
@@ -113,94 +241,346 @@ def detect_scenes(
         scenes = [
             (
                 FrameTimecode(0, fps),
-                FrameTimecode(get_info(video_path).get("num_frames", 1), fps),
+                FrameTimecode(info.get("num_frames", 1), fps),
             )
         ]
 
     return scenes
 
 
-def chunk(
-    iterable: Iterable,
-    n: int,
-    transform: Callable = None,
-    collate_fn: Callable = None,
-    step_size: int | None = None,
-    drop_last: bool = False,
-) -> Iterable:
-    """Yield successive n-sized chunks from iterable."""
-    if step_size is None:
-        step_size = n
-
-    batch = []
-    for x in iterable:
-        if transform is not None:
-            x = transform(x)
-        batch.append(x)
-        if len(batch) == n:
-            if collate_fn:
-                yield collate_fn(batch)
-            else:
-                yield batch
-            batch = batch[step_size:]
-    if batch and not drop_last:
-        if collate_fn:
-            batch = collate_fn(batch)
-        yield batch
-
-
-def transform(snippet):
-    """stack & noralization"""
-    snippet = torch.cat(snippet, dim=-1)
-    snippet = snippet.permute(2, 0, 1).float()
-    snippet = snippet.mul_(2.0).sub_(255).div(255)
-
-    return snippet.view(1, -1, 3, snippet.size(1), snippet.size(2)).permute(
-        0, 2, 1, 3, 4
-    )
+def prefetch_frames(reader, batch_frames=32, max_batches=2, stage_stats=None):
+    """Yield every frame of a video, bulk-decoded on a background thread.
+
+    Runs of `batch_frames` frames are decoded with `VideoReader.get_batch` into a bounded
+    queue of at most `max_batches` batches, so decoding the next window overlaps with
+    inference on the current one.
+
+    Args:
+        reader (decord.VideoReader): Reader over the (downscaled) video. It must not be
+            used by anyone else while the frames are being consumed.
+        batch_frames (int): Number of frames decoded per `get_batch` call.
+        max_batches (int): Number of decoded batches that may be waiting in the queue.
+        stage_stats (StageStats): If given, the decoding is measured as "decode".
+
+    Yields:
+        torch.Tensor: The (H, W, 3) uint8 frames of the video, in order.
+    """
+    batches = queue.Queue(maxsize=max_batches)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def decode():
+        import decord
+
+        # the bridge is thread-local, so it has to be set again on this thread
+        decord.bridge.set_bridge("torch")
+        try:
+            num_frames = len(reader)
+            for start in range(0, num_frames, batch_frames):
+                indices = list(range(start, min(start + batch_frames, num_frames)))
+                with measure(stage_stats, "decode", frames=len(indices)):
+                    batch = reader.get_batch(indices)
+                if not put(batch):
+                    return
+        except Exception as e:
+            put(e)
+        put(None)
+
+    thread = threading.Thread(target=decode, daemon=True)
+    thread.start()
+    try:
+        while True:
+            batch = batches.get()
+            if batch is None:
+                break
+            if isinstance(batch, Exception):
+                raise batch
+            yield from batch
+    finally:
+        stop.set()
+        thread.join()
+
+
+def decode_frames_with_scenes(
+    reader, fps, min_scene_time=1, stage_stats=None, frame_skip=0, min_width=128
+):
+    """Decode every frame of a video once, running scene detection in-line.
+
+    Frames are bulk-decoded on a background thread (see `prefetch_frames`) and handed to
+    an `AdaptiveDetector`, so the same decode pass feeds both scene detection and
+    saliency windowing. The detector only sees every `frame_skip + 1`th frame,
+    downscaled to about `min_width` pixels wide. A cut it reports lies somewhere after
+    the previous frame it saw, so it is moved onto the largest frame-to-frame change in
+    between, and the minimum scene length is only enforced on these refined cuts. Frames
+    are held back long enough for a cut to be known and refined before the frame it
+    starts on is emitted.
+
+    Args:
+        reader (decord.VideoReader): Reader over the (downscaled) video.
+        fps (float): Frame rate of the video.
+        min_scene_time (int): Minimum length of a scene in seconds.
+        stage_stats (StageStats): If given, decoding and scene detection are measured
+            as "decode" and "scene_detect".
+        frame_skip (int): Number of frames the detector skips after every frame it sees.
+        min_width (int): Width the detector's frames are downscaled to, at least.
+
+    Yields:
+        tuple: (frame, is_scene_start) for every frame of the video, in order.
+            The first frame always starts a scene.
+    """
+    detector = AdaptiveDetector(min_scene_len=0)
+    min_scene_len = fps * min_scene_time
+    stride = frame_skip + 1
+    # a cut is reported `event_buffer_length` seen frames late and refined over the
+    # `stride` frames before it
+    lag = (detector.event_buffer_length + 1) * stride + 1
+
+    # [frame_num, frame, is_scene_start] entries that may still be marked as a cut
+    pending = deque()
+    last_cut = None
+
+    def mark_cut(cut):
+        nonlocal last_cut
+        first = pending[0][0]
+        if stride > 1:
+            start = max(cut - stride, first)
+            frames = [
+                np.asarray(pending[frame_num - first][1])
+                for frame_num in range(start, cut + 1)
+            ]
+            cut = start + _largest_change(np.stack(frames))
+        # like the detector, keep the first cut and those far enough from the last one
+        if last_cut is None or cut - last_cut >= min_scene_len:
+            last_cut = cut
+            pending[cut - first][2] = True
+
+    downscale = None
+    for frame_num, frame in enumerate(
+        prefetch_frames(reader, stage_stats=stage_stats)
+    ):
+        pending.append([frame_num, frame, frame_num == 0])
+
+        if frame_num % stride == 0:
+            with measure(stage_stats, "scene_detect", frames=1):
+                frame_img = np.asarray(frame)
+                if downscale is None:
+                    downscale = max(frame_img.shape[1] // min_width, 1)
+                if downscale > 1:
+                    height, width = frame_img.shape[:2]
+                    frame_img = cv2.resize(
+                        frame_img, (round(width / downscale), round(height / downscale))
+                    )
+                # the detector expects BGR frames like the ones OpenCV decodes
+                frame_img = cv2.cvtColor(frame_img, cv2.COLOR_RGB2BGR)
+                cuts = detector.process_frame(frame_num, frame_img)
+                for cut in cuts:
+                    mark_cut(cut)
+
+        while frame_num - pending[0][0] >= lag:
+            _, frame, is_scene_start = pending.popleft()
+            yield frame, is_scene_start
+
+    for cut in detector.post_process(len(reader)):
+        if pending and pending[0][0] <= cut <= pending[-1][0]:
+            mark_cut(cut)
+
+    for _, frame, is_scene_start in pending:
+        yield frame, is_scene_start
+
+
+class FrameRingBuffer:
+    """Sliding temporal windows over decoded frames, backed by a preallocated ring buffer.
+
+    Frames are copied into a (T, H, W, 3) uint8 buffer as they arrive and windows are
+    normalized straight into a caller-provided float tensor, so no per-window lists,
+    concatenations or intermediate copies are allocated. A window is only valid until
+    the next frame is pushed.
+    """
+
+    def __init__(self, temporal_len=32, height=224, width=384):
+        self.temporal_len = temporal_len
+        self.frames = torch.empty((temporal_len, height, width, 3), dtype=torch.uint8)
+        # slot the next frame is written to, which is also the oldest frame once full
+        self.pos = 0
+        self.count = 0
+
+    def push(self, frame):
+        self.frames[self.pos].copy_(frame)
+        self.pos = (self.pos + 1) % self.temporal_len
+        self.count += 1
+
+    def windows(self, frames, step_size=32):
+        """Push `frames` into a fresh window, yielding it every `step_size` frames once full."""
+        self.pos = 0
+        self.count = 0
+        for frame in frames:
+            self.push(frame)
+            if (
+                self.count >= self.temporal_len
+                and (self.count - self.temporal_len) % step_size == 0
+            ):
+                yield self
+
+    def write_clip(self, out):
+        """Stack & normalize the current window into `out`, a float tensor of shape (3, T, H, W)."""
+        split = self.temporal_len - self.pos
+        out[:, :split].copy_(self.frames[self.pos :].permute(3, 0, 1, 2))
+        out[:, split:].copy_(self.frames[: self.pos].permute(3, 0, 1, 2))
+        return out.mul_(2.0).sub_(255).div_(255)
+
+    def thumbnail(self, stride=8):
+        """Return a spatially subsampled float copy of the current window, oldest frame first."""
+        frames = self.frames[:, ::stride, ::stride]
+        return torch.cat([frames[self.pos :], frames[: self.pos]]).float()
+
+    def to_clip(self):
+        """Return the current window as a new (1, 3, T, H, W) clip."""
+        _, height, width, _ = self.frames.shape
+        clip = torch.empty((1, 3, self.temporal_len, height, width))
+        self.write_clip(clip[0])
+        return clip
+
+
+def autocast(amp: bool = True, precision: str = "fp32"):
+    """Autocast context for a forward pass of the saliency model.
+
+    "bf16" autocasts to bfloat16 on any device, including CPU. Otherwise `amp` enables
+    float16 autocast on CUDA and is a no-op on CPU.
+    """
+    if precision == "bf16":
+        return torch.autocast(device.type, dtype=torch.bfloat16)
+    return torch.cuda.amp.autocast(enabled=amp)
 
 
-def process(model, clip, amp: bool = True):
+def process(model, clip, amp: bool = True, precision: str = "fp32"):
     """process one clip and save the predicted saliency map"""
-    with torch.inference_mode(), torch.cuda.amp.autocast(enabled=amp):
-        smap = model(clip.to(device)).float().cpu()[0].clamp(0, 1)
+    return process_batch(model, clip, amp=amp, precision=precision)[0]
+
 
-    smap = gaussian_filter(smap.numpy(), sigma=7)
+def process_batch(
+    model, clips, amp: bool = True, precision: str = "fp32", input_size=None
+):
+    """process a batch of clips in a single forward pass.
+
+    Args:
+        model: The saliency model.
+        clips: A tensor of shape (B, 3, T, H, W) or a list of (1, 3, T, H, W) clips.
+        amp: Whether to use automatic mixed precision.
+        precision: One of `PRECISIONS`. "bf16" runs the model under bfloat16 autocast;
+            "int8" models are already quantized and run as is.
+        input_size: An optional (height, width) to downscale the clips to before the
+            forward pass, both multiples of 32. The saliency maps are upscaled back to
+            the size of the clips.
+
+    Returns:
+        A uint8 ndarray of shape (B, H, W) containing one saliency map per clip.
+    """
+    if not torch.is_tensor(clips):
+        clips = torch.cat(clips, dim=0)
+
+    with torch.inference_mode(), autocast(amp=amp, precision=precision):
+        clips = clips.to(device)
+        height, width = clips.shape[-2:]
+        if input_size is not None and tuple(input_size) != (height, width):
+            clips = F.interpolate(clips, size=(clips.shape[2], *input_size), mode="area")
+            smaps = model(clips).float()
+            smaps = F.interpolate(
+                smaps[:, None], size=(height, width), mode="bilinear"
+            )[:, 0]
+        else:
+            smaps = model(clips).float()
+        smaps = smaps.cpu().clamp(0, 1)
+
+    # blur each map independently, never across the batch dimension
+    smaps = gaussian_filter(smaps.numpy(), sigma=(0, 7, 7))
     # convert to uint8
-    smap = (smap * 255).astype(np.uint8)
-    return smap
+    smaps = (smaps * 255).astype(np.uint8)
+    return smaps
+
 
+def compute_highest_intensity_component(img, min_intensity=50, intensity_step=5):
+    """Find the centroid of the thresholded component with the highest mean intensity.
 
-def compute_highest_intensity_component(img, min_intensity=50):
-    _, thresh = cv2.threshold(img, min_intensity, 255, cv2.THRESH_BINARY)
+    Args:
+        img (np.ndarray): A uint8 saliency map of shape (H, W).
+        min_intensity (int): The initial binarization threshold.
+        intensity_step (int): How much to lower the threshold when no component is found.
 
-    # Find connected components
-    num_labels, labels, stats, centroids = cv2.connectedComponentsWithStats(
-        thresh, connectivity=8
+    Returns:
+        np.ndarray: The (x, y) centroid of the brightest component.
+    """
+    centroids, _ = rank_intensity_components(
+        img, min_intensity=min_intensity, intensity_step=intensity_step
     )
+    return centroids[0]
 
-    # The first component is the background, so exclude it
-    max_label = 1
 
-    max_avg_intensity = np.average(img[labels == 1])
+def rank_intensity_components(img, min_intensity=50, intensity_step=5):
+    """Rank the thresholded components of a saliency map by their mean intensity.
 
-    for i in range(2, num_labels):
-        avg_intensity = np.average(img[labels == i])
-        if avg_intensity > max_avg_intensity:
-            max_label = i
-            max_avg_intensity = avg_intensity
+    The mean intensity of every connected component is computed in a single pass with
+    a labelled bincount reduction. If nothing survives the threshold, it is lowered by
+    `intensity_step` until a component is found.
 
-    # Create an output image that only includes the component with the highest average intensity
-    # output = np.zeros_like(img)
-    # output[labels == max_label] = 255
-    # gray dot at centroid
-    # outputmax_centroid[int(max_centroid[1]), int(max_centroid[0])] = 128
-    try:
-        max_centroid = centroids[max_label]
-    except IndexError:
-        return compute_highest_intensity_component(img, min_intensity - 5)
+    Args:
+        img (np.ndarray): A uint8 saliency map of shape (H, W).
+        min_intensity (int): The initial binarization threshold.
+        intensity_step (int): How much to lower the threshold when no component is found.
+
+    Returns:
+        A (centroids, intensities) pair of the (x, y) centroid and mean intensity of
+        every component, brightest first. A map without any component yields the image
+        center as its only component.
+    """
+    weights = img.ravel().astype(np.float64)
+    threshold = min_intensity
+    while threshold >= 0:
+        _, thresh = cv2.threshold(img, threshold, 255, cv2.THRESH_BINARY)
+
+        # Find connected components
+        num_labels, labels, stats, centroids = cv2.connectedComponentsWithStats(
+            thresh, connectivity=8
+        )
+        # The first component is the background, so exclude it
+        if num_labels > 1:
+            intensity_sums = np.bincount(
+                labels.ravel(), weights=weights, minlength=num_labels
+            )
+            avg_intensities = intensity_sums[1:] / stats[1:, cv2.CC_STAT_AREA]
+            # stable, so ties keep the lowest label like np.argmax
+            order = np.argsort(-avg_intensities, kind="stable")
+            return centroids[1:][order], avg_intensities[order]
+
+        threshold -= intensity_step
+
+    # below zero every pixel is foreground, so the whole image is one component
+    height, width = img.shape[:2]
+    return np.array([[(width - 1) / 2, (height - 1) / 2]]), np.zeros(1)
 
-    return max_centroid
+
+def is_ambiguous_component(centroids, intensities, ratio=0.9, min_separation=24):
+    """Whether the runner-up component could just as well have been picked.
+
+    That is the case when it is at least `ratio` as intense as the brightest component
+    and more than `min_separation` pixels away from it horizontally, which is the only
+    direction the crop follows.
+
+    Args:
+        centroids, intensities: As returned by `rank_intensity_components`.
+    """
+    return (
+        len(intensities) > 1
+        and intensities[1] >= ratio * intensities[0]
+        and abs(centroids[1][0] - centroids[0][0]) > min_separation
+    )
 
 
 def median_filter_centroids(centroids, kernel_size=3):
@@ -216,236 +596,893 @@ def median_filter_centroids(centroids, kernel_size=3):
     return filtered_centroids
 
 
-def interpolate_bounding_boxes(
-    bboxes: torch.Tensor, sentinel: int = -1
-) -> torch.Tensor:
-    """Interpolate bounding boxes that are marked with a sentinel value.
+def _scene_clips(
+    frames,
+    scenes,
+    step_size=32,
+    temporal_len=32,
+):
+    """Yield (scene_num, window) pairs for every window of every scene, in order.
+
+    Each window is a `FrameRingBuffer` that is reused for the next window, so it must be
+    consumed (with `write_clip` or `to_clip`) before the generator is resumed.
 
     Args:
-        bboxes (torch.Tensor): A tensor of shape (N, 4) where N is the number of bounding boxes.
-        sentinel (int): The sentinel value to look for. Defaults to -1.
+        frames: An iterable of (frame, is_scene_start) pairs, as produced by
+            `decode_frames_with_scenes`.
+        scenes (list): Filled in place with the (start_frame, end_frame) bounds of every
+            scene. A scene's bounds are appended before its first window is yielded and its
+            end frame is set before the first window of the next scene is yielded.
+    """
+    frames = iter(frames)
+    # frames that have been decoded but not yet consumed by a scene
+    lookahead = deque()
+
+    def fill(n):
+        while len(lookahead) < n:
+            try:
+                lookahead.append(next(frames))
+            except StopIteration:
+                break
+        return len(lookahead) >= n
+
+    frame_num = 0
+
+    def scene_frames():
+        nonlocal frame_num
+        first = True
+        while fill(1):
+            frame, is_scene_start = lookahead[0]
+            if is_scene_start and not first:
+                return
+            lookahead.popleft()
+            frame_num += 1
+            first = False
+            yield frame
+
+    ring_buffer = None
+    scene_num = 0
+    while fill(1):
+        start_frame = frame_num
+        scenes.append((start_frame, None))
+
+        # prepend the first temporal_len-1 frames in reverse order to the beginning of the scene
+        # so that we can compute the first temporal_len-1 frames
+        fill(temporal_len - 1)
+        head = [frame for frame, _ in itertools.islice(lookahead, temporal_len - 1)]
+        data_iter = itertools.chain(reversed(head), scene_frames())
+
+        if ring_buffer is None:
+            height, width, _ = head[0].shape
+            ring_buffer = FrameRingBuffer(temporal_len, height, width)
+        for window in ring_buffer.windows(data_iter, step_size=step_size):
+            yield scene_num, window
+
+        scenes[scene_num] = (start_frame, frame_num)
+        scene_num += 1
+
+
+def _finalize_scene_centroids(
+    scene_centroids,
+    num_frames,
+    start_time,
+    fps,
+    step_size=32,
+    kernel_size=3,
+    threshold=40,
+    tracking=True,
+):
+    """Smooth the raw per-clip centroids of a scene and time them.
 
     Returns:
-        torch.Tensor: A tensor of shape (N, 4) where N is the number of bounding boxes.
+        A (timestamps, scene_centroids, tracking_timestamps, tracking_centroids) tuple.
+        The tracking entries are None when `tracking` is False.
     """
-    valid_indices = torch.where(bboxes[:, 0] != sentinel)[0]
-    interpolated_bboxes = bboxes.clone()
-    if len(valid_indices) == 0:
-        return interpolated_bboxes
-
-    # if first box is not valid, then repeat the first valid box until the first valid box
-    if valid_indices[0] != 0:
-        interpolated_bboxes[: valid_indices[0]] = interpolated_bboxes[valid_indices[0]]
+    filtered_scene_centroids = median_filter_centroids(
+        np.stack(scene_centroids), kernel_size=kernel_size
+    )
 
-    # if last box is not valid, then repeat the last valid box until the last valid box
-    if valid_indices[-1] != bboxes.shape[0] - 1:
-        interpolated_bboxes[valid_indices[-1] :] = interpolated_bboxes[
-            valid_indices[-1]
+    if tracking:
+        tracking_centroids = [
+            median_filter_centroids(
+                upsample_centroids(np.stack(scene_centroids), step_size)
+            )
         ]
 
-    # interpolate the bounding boxes between the valid boxes
-    for i in range(len(valid_indices) - 1):
-        start = valid_indices[i]
-        end = valid_indices[i + 1]
-        gap = end - start
+    scene_centroids = compute_smoothed_centroids(
+        filtered_scene_centroids,
+        step_size,
+        cluster_threshold=threshold,
+        smoothing_threshold=10,
+    )
 
-        if gap > 1:
-            start_bbox = bboxes[start]
-            end_bbox = bboxes[end]
-            interpolation_weights = torch.linspace(0, 1, gap + 1)[:-1].unsqueeze(-1)
+    num_coords = sum([len(centroid) for centroid in scene_centroids])
+    if num_coords > num_frames:
+        diff = num_coords - num_frames
+        scene_centroids[-1] = scene_centroids[-1][:-diff]
 
-            interpolated_values = start_bbox + interpolation_weights * (
-                end_bbox - start_bbox
-            )
-            interpolated_bboxes[start + 1 : end] = interpolated_values[1:]
+    scene_centroid_lens = [0] + [len(centroid) for centroid in scene_centroids]
+    timestamps = start_time + np.cumsum(scene_centroid_lens) / fps
 
-    return interpolated_bboxes
+    if not tracking:
+        return timestamps, scene_centroids, None, None
 
+    num_tracking_coords = sum([len(centroid) for centroid in tracking_centroids])
+    if num_tracking_coords > num_frames:
+        diff = num_coords - num_frames
+        tracking_centroids[-1] = tracking_centroids[-1][:-diff]
 
-def upsample_centroids(centroids, step_size):
-    """Interpolate centroids to match the original frame rate.
+    # tracking_centroid_lens = [0] + [len(centroid) for centroid in tracking_centroids]
+    # tracking_timestamps = start_time + np.cumsum(tracking_centroid_lens) / fps
 
-    Args:
-        centroids: A list or ndarray of centroids.
-        step_size: The number of frames in between each centroid.
+    tracking_timestamps = np.linspace(
+        start_time, start_time + num_frames / fps, num_frames
+    )
+    return timestamps, scene_centroids, tracking_timestamps, tracking_centroids
 
-    Returns:
-        A torch tensor of shape (len(centroids) * step_size, 2) containing the upsampled centroids.
 
-    """
-    upsampled_centroids = -1 * torch.ones((len(centroids) * step_size, 2))
+def compute_timed_scene_centroids(
+    video_path,
+    model,
+    step_size=32,
+    temporal_len=32,
+    progress_bar=False,
+    kernel_size=3,
+    min_intensity=50,
+    threshold=40,
+    min_scene_len=1,
+    batch_size=4,
+    precision="fp32",
+    tracking=True,
+    skip_threshold=0.0,
+    max_skip=4,
+    coarse_size=None,
+    ambiguity_ratio=0.9,
+    num_workers=1,
+    scene_frame_skip=0,
+):
+    """Compute the smoothed saliency centroids of every scene in a video.
 
-    # scatter the centroids into the upsampled array
-    upsampled_centroids[::step_size] = torch.from_numpy(centroids)
+    See `compute_timed_scene_centroids_for_videos`.
 
-    # interpolate the centroids
-    upsampled_centroids = interpolate_bounding_boxes(upsampled_centroids)
+    Yields:
+        A (timestamps, scene_centroids, tracking_timestamps, tracking_centroids) tuple per scene.
+    """
+    for _, scene in compute_timed_scene_centroids_for_videos(
+        [video_path],
+        model,
+        step_size=step_size,
+        temporal_len=temporal_len,
+        progress_bar=progress_bar,
+        kernel_size=kernel_size,
+        min_intensity=min_intensity,
+        threshold=threshold,
+        min_scene_len=min_scene_len,
+        batch_size=batch_size,
+        precision=precision,
+        tracking=tracking,
+        skip_threshold=skip_threshold,
+        max_skip=max_skip,
+        coarse_size=coarse_size,
+        ambiguity_ratio=ambiguity_ratio,
+        num_workers=num_workers,
+        scene_frame_skip=scene_frame_skip,
+    ):
+        yield scene
 
-    return upsampled_centroids
 
+def _window_centroids(
+    windows,
+    model,
+    clips,
+    precision="fp32",
+    min_intensity=50,
+    skip_threshold=0.0,
+    max_skip=4,
+    coarse_size=None,
+    ambiguity_ratio=0.9,
+    stage_stats=None,
+):
+    """Compute the saliency centroid of every window, batching the model calls.
+
+    Windows are normalized into the preallocated batch tensor `clips` and scored once it
+    is full. Windows that barely differ from the last scored window of their scene reuse
+    its centroid instead, and with a `coarse_size` windows are scored at that size
+    first, see `compute_timed_scene_centroids_for_videos`.
 
-def compute_smoothed_centroids(
-    centroids: list[np.ndarray] | np.ndarray,
-    step_size,
-    cluster_threshold=25,
-    smoothing_threshold=10,
+    Args:
+        windows: An iterable of (scene_key, window) pairs, as produced by `_scene_clips`.
+        clips (torch.Tensor): A (batch_size, 3, T, H, W) float tensor.
+        stage_stats (Callable): If given, maps a scene key to the `StageStats` of its
+            video. The cost of every batch is measured as "inference" and
+            "component_scoring" and split evenly between the windows it scored.
+
+    Yields:
+        A (scene_key, centroid, skipped, refined) tuple per window, in order.
+    """
+    num_clips = 0
+    # (scene_key, source, skipped) of every window since the last batch, in order; the
+    # source is a slot in `clips`, or the centroid of an earlier batch
+    pending = []
+    # the last window that went through the model and how often it has been reused
+    reference = None
+    skipped = 0
+
+    def score(batch, input_size, batch_stats):
+        with measure(batch_stats, "inference", frames=batch.shape[0] * batch.shape[2]):
+            smaps = process_batch(
+                model, batch, precision=precision, input_size=input_size
+            )
+        with measure(batch_stats, "component_scoring", frames=batch.shape[0]):
+            return [
+                rank_intensity_components(smap, min_intensity=min_intensity)
+                for smap in smaps
+            ]
+
+    def process_clips():
+        centroids = []
+        # slots that were scored again at full resolution
+        refined = set()
+        if num_clips:
+            batch_stats = None if stage_stats is None else StageStats()
+            components = score(clips[:num_clips], coarse_size, batch_stats)
+            if coarse_size is not None:
+                # windows whose coarse map has no clear winner are scored at full size
+                refined = [
+                    slot
+                    for slot, (slot_centroids, intensities) in enumerate(components)
+                    if is_ambiguous_component(
+                        slot_centroids, intensities, ratio=ambiguity_ratio
+                    )
+                ]
+                if refined:
+                    for slot, slot_components in zip(
+                        refined, score(clips[refined], None, batch_stats)
+                    ):
+                        components[slot] = slot_components
+                refined = set(refined)
+            centroids = [slot_centroids[0] for slot_centroids, _ in components]
+            if batch_stats is not None:
+                # the windows of a batch may come from several videos
+                for scene_key, _, window_skipped in pending:
+                    # skipped windows may point at a slot too, but were not scored
+                    if not window_skipped:
+                        stage_stats(scene_key).merge(
+                            batch_stats.stages, share=1 / num_clips
+                        )
+        if reference is not None and isinstance(reference["source"], int):
+            reference["source"] = centroids[reference["source"]]
+        for scene_key, source, window_skipped in pending:
+            # a skipped window reuses the centroid of its reference, it was not refined
+            window_refined = not window_skipped and source in refined
+            if isinstance(source, int):
+                source = centroids[source]
+            yield scene_key, source, window_skipped, window_refined
+
+    for scene_key, window in windows:
+        if skip_threshold > 0:
+            thumbnail = window.thumbnail()
+            if (
+                reference is not None
+                and reference["scene_key"] == scene_key
+                and skipped < max_skip
+                and (thumbnail - reference["thumbnail"]).abs_().mean() < skip_threshold
+            ):
+                pending.append((scene_key, reference["source"], True))
+                skipped += 1
+                continue
+            reference = {
+                "scene_key": scene_key,
+                "thumbnail": thumbnail,
+                "source": num_clips,
+            }
+            skipped = 0
+
+        window.write_clip(clips[num_clips])
+        pending.append((scene_key, num_clips, False))
+        num_clips += 1
+        if num_clips == len(clips):
+            yield from process_clips()
+            num_clips = 0
+            pending = []
+
+    if pending:
+        yield from process_clips()
+
+
+def compute_timed_scene_centroids_for_videos(
+    video_paths,
+    model,
+    step_size=32,
+    temporal_len=32,
+    progress_bar=False,
+    kernel_size=3,
+    min_intensity=50,
+    threshold=40,
+    min_scene_len=1,
+    batch_size=4,
+    precision="fp32",
+    tracking=True,
+    skip_threshold=0.0,
+    max_skip=4,
+    coarse_size=None,
+    ambiguity_ratio=0.9,
+    stats=None,
+    num_workers=1,
+    scene_frame_skip=0,
 ):
-    """Compute smoothed centroids from a list of centroids.
+    """Compute the smoothed saliency centroids of every scene in several videos.
+
+    The videos are decoded one after the other, and clips from all of their scenes are
+    collected into batches of `batch_size` so that each forward pass of the model sees
+    several windows at once, even across video boundaries. The resulting saliency maps
+    are routed back to their scenes, and a scene is yielded as soon as all of its clips
+    have been processed.
+
+    Windows that barely differ from the last window of their scene that went through
+    the model reuse its centroid instead. The difference is the mean absolute difference
+    of 8x subsampled frames, in 8-bit intensity levels; windows below `skip_threshold`
+    are skipped, but never more than `max_skip` in a row. A threshold of 0 disables
+    skipping.
+
+    With a `coarse_size` (height, width), both multiples of 32, windows are first scored
+    at that lower resolution. A window is only scored again at full resolution when the
+    runner-up component of its coarse map is at least `ambiguity_ratio` as intense as
+    the brightest one and far enough from it horizontally, see
+    `is_ambiguous_component`. The fraction of scored windows that needed this is
+    reported as "refine_ratio".
+
+    Per-frame tracking centroids are only computed when `tracking` is True; otherwise
+    the tracking entries of each tuple are None.
+
+    `video_paths` may be a lazy iterable, e.g. of downloads as they complete; each video
+    is opened only once the previous one has been decoded.
+
+    Scenes are detected on the same decode pass. The detector only sees every
+    `scene_frame_skip + 1`th frame, and the cuts it finds are refined back to the exact
+    frame, see `decode_frames_with_scenes`.
+
+    With `num_workers` above 1, scenes are scored on a pool of CPU processes instead,
+    see `_parallel_scene_centroids`.
+
+    A video that fails to open, decode or score is skipped without failing the others:
+    none of its scenes are yielded, not even those that were scored before the error.
 
     Args:
-        centroids: A list of centroids.
-        cluster_threshold: The maximum distance between two centroids to be considered part of the same cluster.
-        smoothing_threshold: The maximum distance between two centroids to be collapsed into a single centroid.
-    """
-    clusters = []
-    distances = []
-    current_cluster = [centroids[0]]
-
-    for i in range(1, len(centroids)):
-        dist = cdist([centroids[i]], [centroids[i - 1]], metric="euclidean")
-        if dist <= cluster_threshold:
-            current_cluster.append(centroids[i])
-        else:
-            clusters.append(current_cluster)
-            current_cluster = [centroids[i]]
+        stats (list): If given, a dict of sampling statistics is appended per video,
+            with the cost of every stage under "stages" (see `StageStats`) and, for a
+            video that failed, the error under "error".
 
-    # Add the last cluster
-    if current_cluster:
-        clusters.append(current_cluster)
+    Yields:
+        A (video_num, (timestamps, scene_centroids, tracking_timestamps,
+        tracking_centroids)) pair per scene, in video and scene order.
+    """
+    import decord
 
-    # Compute the median of each cluster
-    median_centroids = np.concatenate(
-        [np.median(cluster, axis=0, keepdims=True) for cluster in clusters]
-    )
-    # compute the distances between the median centroids
-    distances = np.linalg.norm(median_centroids[1:] - median_centroids[:-1], axis=1)
-
-    tiled_median_centroids = []
-    for i in range(len(median_centroids) - 1):
-        num_coords = len(clusters[i]) * step_size
-        if distances[i] <= smoothing_threshold:
-            coords = -1 * np.ones((num_coords, 2))
-            # first coordinate is the median centroid
-            coords[0] = median_centroids[i]
-            # second coordinate is the median centroid of the next cluster
-            coords[-1] = median_centroids[i + 1]
-            coords = interpolate_bounding_boxes(torch.from_numpy(coords))
-            tiled_median_centroids.append(coords.numpy())
-        else:
-            tiled_median_centroids.append(np.tile(median_centroids[i], (num_coords, 1)))
-    # add the last median centroid
-    tiled_median_centroids.append(
-        np.tile(median_centroids[-1], (len(clusters[-1]) * step_size, 1))
-    )
+    decord.bridge.set_bridge("torch")
 
-    return tiled_median_centroids
+    assert temporal_len == 32, "temporal_len must be 32"
+    assert batch_size >= 1, "batch_size must be at least 1"
+
+    if num_workers > 1 and device.type == "cuda":
+        print("Scene workers only run on CPU, scoring scenes in this process")
+        num_workers = 1
+
+    if coarse_size is not None and is_traced_model(model):
+        print("Traced models only score 384x224 windows, not scoring coarse windows")
+        coarse_size = None
+
+    # [fps, scenes, stats] of every video opened so far; scene bounds are appended to
+    # `scenes` as they are discovered
+    videos = []
+
+    def open_video(video_path):
+        stage_stats = StageStats()
+        video_stats = {
+            "windows": 0,
+            "skipped_windows": 0,
+            "skip_ratio": 0.0,
+            "refined_windows": 0,
+            "refine_ratio": 0.0,
+            "stages": stage_stats.stages,
+        }
+        # registered before opening, so a video that fails to open keeps its number
+        videos.append([None, [], video_stats])
+        if stats is not None:
+            stats.append(video_stats)
+        with stage_stats.measure("probe"):
+            reader = decord.VideoReader(
+                video_path, ctx=decord.cpu(), width=384, height=224, num_threads=0
+            )
+            fps = reader.get_avg_fps()
+        # the decoder reads the whole file
+        stage_stats.add("decode", bytes_read=os.path.getsize(video_path))
+        videos[-1][0] = fps
+        return reader, fps
+
+    def fail_video(video_num, error):
+        _, _, video_stats = videos[video_num]
+        if "error" not in video_stats:
+            print(f"Failed to score video {video_num}: {error!r}")
+            video_stats["error"] = repr(error)
+
+    def finalize(video_num, scene_num, scene_centroids):
+        fps, scenes, video_stats = videos[video_num]
+        start_frame, end_frame = scenes[scene_num]
+        num_frames = end_frame - start_frame
 
+        if len(scene_centroids) == 0 and num_frames < temporal_len:
+            # TODO: should probably think more deeply about this
+            return None
+
+        with StageStats(video_stats["stages"]).measure("smoothing", frames=num_frames):
+            return _finalize_scene_centroids(
+                scene_centroids,
+                num_frames,
+                start_frame / fps,
+                fps,
+                step_size=step_size,
+                kernel_size=kernel_size,
+                threshold=threshold,
+                tracking=tracking,
+            )
 
-def compute_timed_scene_centroids(
-    video_path,
+    if num_workers > 1:
+        scored_scenes = _parallel_scene_centroids(
+            video_paths,
+            model,
+            open_video,
+            fail_video,
+            videos,
+            num_workers,
+            step_size=step_size,
+            temporal_len=temporal_len,
+            progress_bar=progress_bar,
+            min_intensity=min_intensity,
+            min_scene_len=min_scene_len,
+            batch_size=batch_size,
+            precision=precision,
+            skip_threshold=skip_threshold,
+            max_skip=max_skip,
+            coarse_size=coarse_size,
+            ambiguity_ratio=ambiguity_ratio,
+            scene_frame_skip=scene_frame_skip,
+        )
+    else:
+        scored_scenes = _serial_scene_centroids(
+            video_paths,
+            model,
+            open_video,
+            fail_video,
+            videos,
+            step_size=step_size,
+            temporal_len=temporal_len,
+            progress_bar=progress_bar,
+            min_intensity=min_intensity,
+            min_scene_len=min_scene_len,
+            batch_size=batch_size,
+            precision=precision,
+            skip_threshold=skip_threshold,
+            max_skip=max_skip,
+            coarse_size=coarse_size,
+            ambiguity_ratio=ambiguity_ratio,
+            scene_frame_skip=scene_frame_skip,
+        )
+
+    for video_num, scene_num, scene_centroids in scored_scenes:
+        if "error" in videos[video_num][2]:
+            continue
+        try:
+            scene = finalize(video_num, scene_num, scene_centroids)
+        except Exception as e:
+            fail_video(video_num, e)
+            continue
+        if scene is not None:
+            yield video_num, scene
+
+    for _, _, video_stats in videos:
+        video_stats["skip_ratio"] = video_stats["skipped_windows"] / max(
+            video_stats["windows"], 1
+        )
+        video_stats["refine_ratio"] = video_stats["refined_windows"] / max(
+            video_stats["windows"] - video_stats["skipped_windows"], 1
+        )
+
+
+def _serial_scene_centroids(
+    video_paths,
     model,
+    open_video,
+    fail_video,
+    videos,
     step_size=32,
     temporal_len=32,
     progress_bar=False,
-    kernel_size=3,
     min_intensity=50,
-    threshold=40,
     min_scene_len=1,
+    batch_size=4,
+    precision="fp32",
+    skip_threshold=0.0,
+    max_skip=4,
+    coarse_size=None,
+    ambiguity_ratio=0.9,
+    scene_frame_skip=0,
 ):
-    import decord
-    import multiprocessing
-    import os
+    """Score the windows of every scene in this process, with a single decode pass per video.
+
+    Yields:
+        A (video_num, scene_num, centroids) tuple per scene, in order, with the raw
+        centroid of every window of the scene.
+    """
+
+    def video_clips(pbar):
+        for video_num, video_path in enumerate(video_paths):
+            try:
+                reader, fps = open_video(video_path)
+                _, scenes, video_stats = videos[video_num]
+                pbar.total += len(reader) // step_size
+                pbar.refresh()
+
+                # a single decode pass feeds both scene detection and the saliency
+                # windows
+                frames = decode_frames_with_scenes(
+                    reader,
+                    fps,
+                    min_scene_time=min_scene_len,
+                    frame_skip=scene_frame_skip,
+                    stage_stats=StageStats(video_stats["stages"]),
+                )
+                for scene_num, window in _scene_clips(
+                    frames, scenes, step_size=step_size, temporal_len=temporal_len
+                ):
+                    yield (video_num, scene_num), window
+            except Exception as e:
+                fail_video(video_num, e)
+
+    centroids_per_scene = defaultdict(list)
+    next_scene = (0, 0)
+
+    def finished_scenes(upto):
+        # scenes before the (video_num, scene_num) `upto` have received all of their clips
+        nonlocal next_scene
+        while next_scene < upto:
+            video_num, scene_num = next_scene
+            _, scenes, _ = videos[video_num]
+            if scene_num == len(scenes):
+                # all scenes of every video before `upto` are known
+                next_scene = (video_num + 1, 0)
+                continue
+            next_scene = (video_num, scene_num + 1)
+            scene_centroids = centroids_per_scene.pop((video_num, scene_num), [])
+            yield video_num, scene_num, scene_centroids
+
+    # windows are normalized straight into this reused batch tensor
+    clips = torch.empty((batch_size, 3, temporal_len, 224, 384))
+
+    with tqdm(total=0, disable=not progress_bar, desc="Clips") as pbar:
+        for scene_key, centroid, skipped, refined in _window_centroids(
+            video_clips(pbar),
+            model,
+            clips,
+            precision=precision,
+            min_intensity=min_intensity,
+            skip_threshold=skip_threshold,
+            max_skip=max_skip,
+            coarse_size=coarse_size,
+            ambiguity_ratio=ambiguity_ratio,
+            stage_stats=lambda scene_key: StageStats(videos[scene_key[0]][2]["stages"]),
+        ):
+            _, _, video_stats = videos[scene_key[0]]
+            video_stats["windows"] += 1
+            video_stats["skipped_windows"] += skipped
+            video_stats["refined_windows"] += refined
+            centroids_per_scene[scene_key].append(centroid)
+            pbar.update(1)
 
-    os.environ["OMP_NUM_THREADS"] = str(8 * multiprocessing.cpu_count())
+            # every scene before this one has received all of its clips
+            yield from finished_scenes(scene_key)
+
+    yield from finished_scenes((len(videos), 0))
+
+
+# model of a scene worker process, loaded by `_init_scene_worker`
+_worker_model = None
+
+
+def _init_scene_worker(engine, precision, num_threads):
+    global _worker_model
+    import decord
 
     decord.bridge.set_bridge("torch")
+    torch.set_num_threads(num_threads)
+    # the weights are memory-mapped, so every worker shares the same pages
+    _worker_model = load_tased_model("cpu", engine=engine, precision=precision)
 
-    assert temporal_len == 32, "temporal_len must be 32"
-    reader = decord.VideoReader(
-        video_path, ctx=decord.cpu(), width=384, height=224, num_threads=0
-    )
-    fps = reader.get_avg_fps()
-    scenes = detect_scenes(video_path, show_progress=True)
-    # prepend the first temporal_len-1 frames in reverse order to the beginning of the video reader
-    # so that we can compute the first temporal_len-1 frames
-
-    num_scenes = len(scenes)
-    total_frames = len(reader)
-    for scene_num, (start, end) in enumerate(scenes):
-        # bounds of current scene
-        start_frame, end_frame = start.get_frames(), end.get_frames()
-        start_time = start.get_seconds()
 
-        num_frames = end_frame - start_frame
-        end_frame_1 = min(start_frame + temporal_len - 1, total_frames)
-        end_frame_2 = min(end_frame, total_frames)
+# pools of scene workers by (num_workers, engine, precision), kept across calls so the
+# workers only start and load their model once
+_scene_pools = {}
 
-        data_iter = itertools.chain(
-            reversed(reader[start_frame:end_frame_1]),
-            map(reader.__getitem__, range(start_frame, end_frame_2)),
-        )
 
-        num_chunks = (num_frames - temporal_len) // step_size + 1
-        scene_centroids = []
-        for clip in tqdm(
-            chunk(
-                data_iter,
-                temporal_len,
-                step_size=step_size,
-                collate_fn=transform,
-                drop_last=True,
-            ),
-            total=num_chunks,
-            disable=not progress_bar,
-            desc=f"Scene {scene_num+1:02d}/{num_scenes:02d}",
-        ):
-            smap = process(model, clip)
-            scene_centroid = compute_highest_intensity_component(
-                smap, min_intensity=min_intensity
-            )
-            scene_centroids.append(scene_centroid)
+def _scene_pool(num_workers, engine, precision):
+    """Return the pool of `num_workers` scene worker processes, starting it if needed.
 
-        if len(scene_centroids) == 0 and num_frames < temporal_len:
-            # TODO: should probably think more deeply about this
-            continue
+    The workers are spawned rather than forked: a child forked after the intra-op
+    thread pool has run can deadlock on its first forward pass.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    import multiprocessing
 
-        filtered_scene_centroids = median_filter_centroids(
-            np.stack(scene_centroids), kernel_size=kernel_size
+    key = (num_workers, engine, precision)
+    if key not in _scene_pools:
+        num_threads = max(multiprocessing.cpu_count() // num_workers, 1)
+        _scene_pools[key] = ProcessPoolExecutor(
+            num_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_scene_worker,
+            initargs=(engine, precision, num_threads),
         )
+    return _scene_pools[key]
 
-        tracking_centroids = [
-            median_filter_centroids(
-                upsample_centroids(np.stack(scene_centroids), step_size)
-            )
-        ]
 
-        scene_centroids = compute_smoothed_centroids(
-            filtered_scene_centroids,
-            step_size,
-            cluster_threshold=threshold,
-            smoothing_threshold=10,
+def _scene_tasks(
+    start_frame,
+    end_frame,
+    num_frames,
+    step_size=32,
+    temporal_len=32,
+    windows_per_task=8,
+):
+    """Split the windows of a scene into tasks of at most `windows_per_task` windows.
+
+    Returns:
+        list: A (start_frame, end_frame, first_window, stop_window) tuple per task, in
+        order.
+    """
+    head_len = min(temporal_len - 1, num_frames - start_frame)
+    data_len = head_len + end_frame - start_frame
+    num_windows = max((data_len - temporal_len) // step_size + 1, 0)
+    return [
+        (
+            start_frame,
+            end_frame,
+            first_window,
+            min(first_window + windows_per_task, num_windows),
         )
+        for first_window in range(0, num_windows, windows_per_task)
+    ]
 
-        num_coords = sum([len(centroid) for centroid in scene_centroids])
-        if num_coords > num_frames:
-            diff = num_coords - num_frames
-            scene_centroids[-1] = scene_centroids[-1][:-diff]
 
-        num_tracking_coords = sum([len(centroid) for centroid in tracking_centroids])
-        if num_tracking_coords > num_frames:
-            diff = num_coords - num_frames
-            tracking_centroids[-1] = tracking_centroids[-1][:-diff]
+def _score_scene_task(
+    video_path,
+    task,
+    step_size=32,
+    temporal_len=32,
+    batch_size=4,
+    precision="fp32",
+    min_intensity=50,
+    skip_threshold=0.0,
+    max_skip=4,
+    coarse_size=None,
+    ambiguity_ratio=0.9,
+):
+    """Score a range of windows of one scene in a worker process.
+
+    The worker seeks its own reader to the frames of the windows and rebuilds them the
+    way `_scene_clips` does, including the reversed warm-up frames at the start of the
+    scene.
 
-        scene_centroid_lens = [0] + [len(centroid) for centroid in scene_centroids]
-        timestamps = start_time + np.cumsum(scene_centroid_lens) / fps
+    Returns:
+        A (centroids, skipped_windows, refined_windows, stages) tuple, with the cost of
+        the task's stages as measured by a `StageStats`.
+    """
+    import decord
+
+    start_frame, end_frame, first_window, stop_window = task
+    reader = decord.VideoReader(
+        video_path, ctx=decord.cpu(), width=384, height=224, num_threads=1
+    )
+    head_len = min(temporal_len - 1, len(reader) - start_frame)
+
+    def frame_index(position):
+        # the scene is preceded by its first frames in reverse order
+        if position < head_len:
+            return start_frame + head_len - 1 - position
+        return start_frame + position - head_len
+
+    positions = range(
+        first_window * step_size, (stop_window - 1) * step_size + temporal_len
+    )
+
+    stage_stats = StageStats()
+
+    def frames():
+        for start in range(0, len(positions), temporal_len):
+            indices = positions[start : start + temporal_len]
+            with stage_stats.measure("decode", frames=len(indices)):
+                batch = reader.get_batch([frame_index(index) for index in indices])
+            yield from batch
+
+    height, width, _ = reader[0].shape
+    ring_buffer = FrameRingBuffer(temporal_len, height, width)
+    windows = ((0, window) for window in ring_buffer.windows(frames(), step_size))
+    clips = torch.empty((batch_size, 3, temporal_len, height, width))
+
+    centroids = []
+    skipped_windows = 0
+    refined_windows = 0
+    for _, centroid, skipped, refined in _window_centroids(
+        windows,
+        _worker_model,
+        clips,
+        precision=precision,
+        min_intensity=min_intensity,
+        skip_threshold=skip_threshold,
+        max_skip=max_skip,
+        coarse_size=coarse_size,
+        ambiguity_ratio=ambiguity_ratio,
+        stage_stats=lambda _: stage_stats,
+    ):
+        centroids.append(centroid)
+        skipped_windows += skipped
+        refined_windows += refined
+    return centroids, skipped_windows, refined_windows, stage_stats.stages
 
-        # tracking_centroid_lens = [0] + [len(centroid) for centroid in tracking_centroids]
-        # tracking_timestamps = start_time + np.cumsum(tracking_centroid_lens) / fps
 
-        tracking_timestamps = np.linspace(
-            start_time, start_time + num_frames / fps, num_frames
+def _parallel_scene_centroids(
+    video_paths,
+    model,
+    open_video,
+    fail_video,
+    videos,
+    num_workers,
+    step_size=32,
+    temporal_len=32,
+    progress_bar=False,
+    min_intensity=50,
+    min_scene_len=1,
+    batch_size=4,
+    precision="fp32",
+    skip_threshold=0.0,
+    max_skip=4,
+    coarse_size=None,
+    ambiguity_ratio=0.9,
+    scene_frame_skip=0,
+    windows_per_task=8,
+):
+    """Score the windows of every scene on a pool of `num_workers` CPU processes.
+
+    This process only decodes the videos for scene detection. As soon as the in-line
+    detector closes a scene, its windows are split into tasks of at most
+    `windows_per_task` windows, so long shots are spread over the pool too, and handed
+    to the pool; each worker decodes the frames of its tasks with its own seeking
+    reader. Scenes are yielded in order as their tasks finish, while later scenes and
+    videos are still being detected. Windows are only compared against earlier windows
+    of the same task for adaptive sampling.
+
+    The workers load their own copy of the model, with the engine of `model` and
+    `precision`, and split the CPU cores evenly between their intra-op thread pools
+    (see `_scene_pool`).
+
+    Yields:
+        A (video_num, scene_num, centroids) tuple per scene, in order, with the raw
+        centroid of every window of the scene.
+    """
+    from concurrent.futures.process import BrokenProcessPool
+
+    engine = "torchscript" if is_traced_model(model) else "eager"
+    executor = _scene_pool(num_workers, engine, precision)
+    # (video_num, scene_num, results) of every scene handed to the pool that hasn't
+    # been yielded yet, in order
+    submitted = deque()
+
+    def finished_scenes(pbar, wait):
+        while submitted and (wait or all(r.done() for r in submitted[0][2])):
+            video_num, scene_num, results = submitted.popleft()
+            _, _, video_stats = videos[video_num]
+            stage_stats = StageStats(video_stats["stages"])
+            scene_centroids = []
+            for result in results:
+                try:
+                    centroids, skipped, refined, stages = result.result()
+                except BrokenProcessPool:
+                    raise
+                except Exception as e:
+                    fail_video(video_num, e)
+                    continue
+                stage_stats.merge(stages)
+                scene_centroids.extend(centroids)
+                video_stats["windows"] += len(centroids)
+                video_stats["skipped_windows"] += skipped
+                video_stats["refined_windows"] += refined
+                pbar.update(len(centroids))
+            yield video_num, scene_num, scene_centroids
+
+    def submit(video_num, video_path, start_frame, end_frame, num_frames, pbar):
+        _, scenes, _ = videos[video_num]
+        scenes.append((start_frame, end_frame))
+        tasks = _scene_tasks(
+            start_frame,
+            end_frame,
+            num_frames,
+            step_size=step_size,
+            temporal_len=temporal_len,
+            windows_per_task=windows_per_task,
         )
-        yield timestamps, scene_centroids, tracking_timestamps, tracking_centroids
+        pbar.total += sum(stop - first for _, _, first, stop in tasks)
+        pbar.refresh()
+        results = [
+            executor.submit(
+                _score_scene_task,
+                video_path,
+                task,
+                step_size=step_size,
+                temporal_len=temporal_len,
+                batch_size=batch_size,
+                precision=precision,
+                min_intensity=min_intensity,
+                skip_threshold=skip_threshold,
+                max_skip=max_skip,
+                coarse_size=coarse_size,
+                ambiguity_ratio=ambiguity_ratio,
+            )
+            for task in tasks
+        ]
+        submitted.append((video_num, len(scenes) - 1, results))
+
+    with tqdm(total=0, disable=not progress_bar, desc="Clips") as pbar:
+        try:
+            for video_num, video_path in enumerate(video_paths):
+                try:
+                    reader, fps = open_video(video_path)
+                    _, _, video_stats = videos[video_num]
+                    num_frames = len(reader)
+
+                    start_frame = 0
+                    for frame_num, (_, is_scene_start) in enumerate(
+                        decode_frames_with_scenes(
+                            reader,
+                            fps,
+                            min_scene_time=min_scene_len,
+                            frame_skip=scene_frame_skip,
+                            stage_stats=StageStats(video_stats["stages"]),
+                        )
+                    ):
+                        if is_scene_start and frame_num > 0:
+                            submit(
+                                video_num,
+                                video_path,
+                                start_frame,
+                                frame_num,
+                                num_frames,
+                                pbar,
+                            )
+                            start_frame = frame_num
+                            yield from finished_scenes(pbar, wait=False)
+                    if num_frames > 0:
+                        submit(
+                            video_num,
+                            video_path,
+                            start_frame,
+                            num_frames,
+                            num_frames,
+                            pbar,
+                        )
+                except BrokenProcessPool:
+                    raise
+                except Exception as e:
+                    fail_video(video_num, e)
+                yield from finished_scenes(pbar, wait=False)
+            yield from finished_scenes(pbar, wait=True)
+        except BrokenProcessPool:
+            # a worker died, start a new pool for the next call
+            _scene_pools.pop((num_workers, engine, precision), None)
+            raise
+        finally:
+            # the pool outlives this call, cancel what an abandoned call left in it
+            for _, _, results in submitted:
+                for result in results:
+                    result.cancel()
 
 
 def compute_portrait_from_hcenter(hcenter: int, img_size, new_aspect_ratio=9 / 16):
@@ -512,59 +1549,135 @@ def normalize_bbox(bbox, size):
 BBox = namedtuple("BBox", ["start_time", "end_time", "bbox", "is_scene_boundary"])
 
 
-def _compute_turning_points(data, min_change: float = 0.05, max_drift: float = 0.5):
-    """Compute the turning points of a discrete function.
+# step classes of `compute_turning_points`; a step of exactly +-min_change keeps the
+# current direction
+_FLAT, _RISING, _FALLING, _TIED = 0, 1, -1, 2
+
+
+def _first_drift_reset(diff, start, end, drift, max_drift, window=64):
+    """Find the first step in diff[start:end] at which the accumulated drift resets.
+
+    The drift before step i is `drift` plus diff[start:i], accumulated in order. A reset
+    happens at the first step whose preceding drift exceeds `max_drift`.
+
+    Returns:
+        int: The reset step, or `end` if there is none.
+    """
+    i = start
+    while i < end:
+        stop = min(i + window, end)
+        drifts = np.cumsum(np.concatenate([[drift], diff[i:stop]]))
+        exceeded = np.flatnonzero(np.abs(drifts[:-1]) > max_drift)
+        if len(exceeded):
+            return i + int(exceeded[0])
+        drift = drifts[-1]
+        i = stop
+        window *= 2
+    return end
+
+
+def _next_drift_resets(diff, run_ends, max_drift, lookahead=8):
+    """For every step, find the next drift reset if the drift was reset at that step.
 
     Args:
-        data (list[float]): The discrete function.
+        run_ends: The end of the run of every step; resets never cross it.
+
+    Returns:
+        np.ndarray: The next reset step, the run's end if there is none, or -1 if it is
+        more than `lookahead` steps away.
     """
-    # diff = np.diff(np.concatenate([[data[0]], data, [data[-1]]]))
-    diff = np.diff(data)
-    curr_direction = 0
-    curr_drift = 0
-    yield 0
-    for i, d in enumerate(diff):
-        if abs(curr_drift) > max_drift:
-            curr_direction = np.sign(curr_drift)
-            if curr_direction != 0:
-                curr_drift = 0
-                yield i
-            curr_direction = 0
-        if abs(d) < min_change:
-            if curr_direction != 0:
-                curr_drift = 0
-                yield i
-            curr_direction = 0
-        if d > min_change:
-            if curr_direction != 1:
-                curr_drift = 0
-                yield i
-            curr_direction = 1
-        elif d < -min_change:
-            if curr_direction != -1:
-                curr_drift = 0
-                yield i
-            curr_direction = -1
-        curr_drift += d
-
-    yield len(data) - 1
+    steps = np.arange(len(diff))
+    next_resets = np.full(len(diff), -1)
+    pending = np.ones(len(diff), dtype=bool)
+    # accumulated in the same order as a step by step walk, so thresholds compare equal
+    drifts = diff.copy()
+    for offset in range(1, lookahead + 1):
+        candidates = steps + offset
+        ended = pending & (candidates >= run_ends)
+        next_resets[ended] = run_ends[ended]
+        pending &= ~ended
+
+        exceeded = pending & (np.abs(drifts) > max_drift)
+        next_resets[exceeded] = candidates[exceeded]
+        pending &= ~exceeded
+        if not pending.any():
+            break
+        drifts[pending] += diff[candidates[pending]]
+    return next_resets
 
 
 def compute_turning_points(data, min_change: float = 0.15, max_drift=0.5):
     """Compute the turning points of a discrete function.
 
+    A turning point starts wherever the function starts rising, falling or staying flat
+    (a step of at least `min_change`), and wherever the change accumulated since the last
+    turning point exceeds `max_drift`. Steps are classified and drift resets are looked
+    up with array operations, so walking the function costs a table lookup per turning
+    point rather than a Python iteration per step.
+
     Args:
         data (list[float]): The discrete function.
+
+    Returns:
+        list[int]: The sorted indices of the turning points, including the first and last.
     """
-    return sorted(
-        list(
-            set(
-                _compute_turning_points(
-                    data, min_change=min_change, max_drift=max_drift
-                )
+    diff = np.diff(np.asarray(data)).astype(np.float64)
+
+    classes = np.full(len(diff), _TIED, dtype=np.int8)
+    classes[np.abs(diff) < min_change] = _FLAT
+    classes[diff < -min_change] = _FALLING
+    classes[diff > min_change] = _RISING
+
+    # prepend a class that never occurs so the first step always starts a run
+    run_starts = np.flatnonzero(np.diff(classes, prepend=_TIED + 1))
+    run_ends = np.append(run_starts, len(diff))[1:]
+    next_resets = _next_drift_resets(
+        diff, np.repeat(run_ends, run_ends - run_starts), max_drift
+    ).tolist()
+
+    turning_points = [0]
+    direction = _FLAT
+    drift = 0.0
+    for start, end in zip(run_starts.tolist(), run_ends.tolist()):
+        run_class = classes[start]
+
+        # the first step of a run may change direction
+        reset = abs(drift) > max_drift
+        if reset:
+            direction = _FLAT
+        if run_class != _TIED and run_class != direction:
+            reset = True
+            direction = run_class
+
+        if reset:
+            last_reset = start
+        else:
+            # the drift carried into the run delays its first reset
+            last_reset = _first_drift_reset(
+                diff, start + 1, end, drift + diff[start], max_drift
             )
-        )
-    )
+            if last_reset == end:
+                drift = np.cumsum(np.concatenate([[drift], diff[start:end]]))[-1]
+                continue
+        turning_points.append(last_reset)
+        if run_class == _TIED:
+            direction = _FLAT
+
+        # the rest of the run keeps its direction, only the drift can reset
+        while True:
+            next_reset = next_resets[last_reset]
+            if next_reset == -1:
+                next_reset = _first_drift_reset(
+                    diff, last_reset + 1, end, diff[last_reset], max_drift
+                )
+            if next_reset == end:
+                break
+            turning_points.append(next_reset)
+            last_reset = next_reset
+        drift = np.cumsum(diff[last_reset:end])[-1]
+
+    turning_points.append(len(data) - 1)
+    return sorted(set(turning_points))
 
 
 def get_bbox_center(bbox):
@@ -654,10 +1767,44 @@ def post_process_scene_bboxes(
     return processed_bboxes
 
 
-def load_tased_model(device="cuda"):
-    curr_dir = os.path.dirname(os.path.abspath(__file__))
-    file_weight = os.path.join(curr_dir, "TASED_updated.pt")
-    print(file_weight)
+def compile_tased_model(
+    model, device="cuda", input_shape=(1, 3, 32, 224, 384), atol=ENGINE_ATOL
+):
+    """Compile an eval-mode TASED_v2 into a frozen, optimized TorchScript graph.
+
+    BatchNorms are folded into their convolutions before tracing, and
+    `torch.jit.optimize_for_inference` fuses the remaining ReLUs into the convolutions
+    where the backend supports it. The compiled graph is checked against the eager
+    model on a random clip.
+
+    Args:
+        model: The eager model, left untouched.
+        device: The device the model lives on.
+        input_shape: The (B, 3, T, H, W) shape of the clip used for tracing.
+        atol: Maximum absolute difference allowed between the two saliency maps.
+
+    Returns:
+        The compiled model, or `model` if the outputs differ by more than `atol`.
+    """
+    example = torch.rand(input_shape, device=device) * 2 - 1
+    with torch.no_grad():
+        expected = model(example)
+
+        fused = fuse_for_inference(copy.deepcopy(model))
+        compiled = torch.jit.freeze(torch.jit.trace(fused, example))
+        compiled = torch.jit.optimize_for_inference(compiled)
+        actual = compiled(example)
+
+    max_diff = (actual - expected).abs().max().item()
+    print(f" compiled model max abs diff: {max_diff:.2e}")
+    if max_diff > atol:
+        print(f" compiled model exceeds tolerance {atol:.0e}, using eager model")
+        return model
+    return compiled
+
+
+def _load_tased_checkpoint(file_weight):
+    """Build TASED_v2 and copy in the checkpoint's weights, rewriting their names."""
     model = TASED_v2()
     if os.path.isfile(file_weight):
         print("loading weight file")
@@ -676,16 +1823,124 @@ def load_tased_model(device="cuda"):
         print(" loaded")
     else:
         print("weight file?")
+    return model
+
+
+def _load_tased_fast(file_fast):
+    """Build TASED_v2 straight from a memory-mapped state dict, without initializing it."""
+    with torch.device("meta"):
+        model = TASED_v2()
+    state_dict = torch.load(file_fast, map_location="cpu", mmap=True, weights_only=True)
+    model.load_state_dict(state_dict, assign=True)
+    return model
+
+
+def convert_tased_weights(file_weight=None, output=None):
+    """Write the TASED_v2 weights as a state dict that `load_tased_model` can memory-map.
+
+    The state dict is taken from a model loaded from the original checkpoint, so the
+    fast path yields exactly the same model without any name rewriting.
+    """
+    file_weight = file_weight or TASED_WEIGHT_FILE
+    output = output or TASED_FAST_WEIGHT_FILE
+    if not os.path.isfile(file_weight):
+        print(f"weight file? {file_weight}")
+        return
+    torch.save(_load_tased_checkpoint(file_weight).state_dict(), output)
+    print(f"saved fast weights to {output}")
+
+
+def load_tased_model(device="cuda", engine="eager", precision="fp32"):
+    """Load the TASED_v2 saliency model.
+
+    Weights converted by `convert_tased_weights` are memory-mapped straight into an
+    uninitialized model. Without them, or if they are older than the checkpoint, the
+    checkpoint is loaded and its parameter names rewritten on the fly.
+
+    Args:
+        device: The device to load the model on.
+        engine: One of `ENGINES`. "eager" runs the PyTorch module as is, "torchscript"
+            runs a BatchNorm-folded, frozen TorchScript graph (see `compile_tased_model`).
+        precision: One of `PRECISIONS`. "int8" loads the statically quantized CPU model
+            produced by `aspect_ratio.quantization`, regardless of `engine`. "fp32" and
+            "bf16" load the same weights; bf16 is applied by `process_batch`.
+    """
+    assert engine in ENGINES, f"engine must be one of {ENGINES}"
+    assert precision in PRECISIONS, f"precision must be one of {PRECISIONS}"
+
+    if precision == "int8":
+        file_int8 = TASED_INT8_WEIGHT_FILE
+        if torch.device(device).type == "cpu" and os.path.isfile(file_int8):
+            print(f"loading int8 model {file_int8}")
+            model = torch.jit.load(file_int8, map_location="cpu")
+            model.eval()
+            return model
+        print("int8 model? falling back to fp32")
+
+    file_weight = TASED_WEIGHT_FILE
+    file_fast = TASED_FAST_WEIGHT_FILE
+    if os.path.isfile(file_fast) and (
+        not os.path.isfile(file_weight)
+        or os.path.getmtime(file_fast) >= os.path.getmtime(file_weight)
+    ):
+        print(f"loading fast weights {file_fast}")
+        model = _load_tased_fast(file_fast)
+    else:
+        print(file_weight)
+        model = _load_tased_checkpoint(file_weight)
 
     model = model.to(device)
     torch.backends.cudnn.benchmark = False
     model.eval()
+
+    if engine == "torchscript":
+        model = compile_tased_model(model, device=device)
     return model
 
 
-def compute_portrait_square_bboxes_with_scenes(
+def is_traced_model(model) -> bool:
+    """Whether the model is a frozen TorchScript graph ("torchscript" or "int8").
+
+    Freezing folds the unpooling output sizes of the traced 384x224 clip into the graph,
+    so such a model can't score windows at any other size.
+    """
+    return isinstance(model, torch.jit.ScriptModule)
+
+
+def warm_up_tased_model(
+    model, batch_size=4, temporal_len=32, precision="fp32", coarse_size=None
+):
+    """Run the model once on a blank batch, at every size it will score windows at.
+
+    Pays the one-off allocation and kernel selection costs of the first forward pass
+    before the first job instead of during it.
+
+    Args:
+        coarse_size (tuple): (height, width) of coarse scoring, if it is used, warmed up
+            on top of the full 384x224 windows.
+    """
+    clips = torch.zeros((batch_size, 3, temporal_len, 224, 384))
+    for input_size in [None] + ([coarse_size] if coarse_size is not None else []):
+        process_batch(model, clips, precision=precision, input_size=input_size)
+
+
+SCENE_MODE = "scene"
+TRACKING_MODE = "tracking"
+BBOX_MODES = (SCENE_MODE, TRACKING_MODE)
+
+
+def parse_aspect_ratio(aspect_ratio) -> float:
+    """Parse a width / height aspect ratio given as a number or a "width:height" string."""
+    if isinstance(aspect_ratio, str):
+        width, height = aspect_ratio.split(":")
+        return float(width) / float(height)
+    return float(aspect_ratio)
+
+
+def compute_bboxes_with_scenes(
     video_path,
-    model = None,
+    outputs: Collection[Tuple[Union[float, str], str]],
+    model=None,
     step_size=32,
     temporal_len=32,
     progress_bar=False,
@@ -693,24 +1948,119 @@ def compute_portrait_square_bboxes_with_scenes(
     min_intensity=50,
     threshold=40,
     min_scene_len=1,
-) -> tuple[list, list, list, list]:
-    
-    if model is None:
-        model = load_tased_model(device)
+    batch_size=4,
+    precision="fp32",
+    skip_threshold=0.0,
+    max_skip=4,
+    coarse_size=None,
+    ambiguity_ratio=0.9,
+    num_workers=1,
+    scene_frame_skip=0,
+) -> Dict[Tuple[Union[float, str], str], List[BBox]]:
+    """Compute crop boxes for the requested aspect ratios and modes only.
+
+    Saliency inference runs once regardless of how many outputs are requested. Per-frame
+    tracking centroids and turning points are only computed if a tracking output is
+    requested.
 
+    Args:
+        video_path: Path to the video file.
+        outputs: (aspect_ratio, mode) pairs to compute. Aspect ratios are width / height,
+            either as a number (9 / 16) or a string ("4:5"); modes are one of `BBOX_MODES`.
+
+    Returns:
+        dict: Maps each requested (aspect_ratio, mode) pair to its list of BBoxes.
+    """
+    stats = []
+    boxes = compute_bboxes_for_videos(
+        [video_path],
+        outputs,
+        model=model,
+        step_size=step_size,
+        temporal_len=temporal_len,
+        progress_bar=progress_bar,
+        kernel_size=kernel_size,
+        min_intensity=min_intensity,
+        threshold=threshold,
+        min_scene_len=min_scene_len,
+        batch_size=batch_size,
+        precision=precision,
+        skip_threshold=skip_threshold,
+        max_skip=max_skip,
+        coarse_size=coarse_size,
+        ambiguity_ratio=ambiguity_ratio,
+        stats=stats,
+        num_workers=num_workers,
+        scene_frame_skip=scene_frame_skip,
+    )[0]
+    if boxes is None:
+        raise RuntimeError(
+            f"Failed to compute the boxes of {video_path}: {stats[0]['error']}"
+        )
+    return boxes
 
-    square_scene_boxes = []
-    portrait_scene_boxes = []
-    square_tracking_boxes = []
-    portrait_tracking_boxes = []
 
-    for (
+def compute_bboxes_for_videos(
+    video_paths,
+    outputs: Collection[Tuple[Union[float, str], str]],
+    model=None,
+    step_size=32,
+    temporal_len=32,
+    progress_bar=False,
+    kernel_size=3,
+    min_intensity=50,
+    threshold=40,
+    min_scene_len=1,
+    batch_size=4,
+    precision="fp32",
+    skip_threshold=0.0,
+    max_skip=4,
+    coarse_size=None,
+    ambiguity_ratio=0.9,
+    stats=None,
+    num_workers=1,
+    scene_frame_skip=0,
+) -> List[Dict[Tuple[Union[float, str], str], List[BBox]]]:
+    """Compute crop boxes for several videos, sharing model batches between them.
+
+    See `compute_bboxes_with_scenes` for the arguments. `video_paths` may be a lazy
+    iterable, `skip_threshold`, `max_skip` and `stats` control adaptive sampling and
+    `coarse_size` and `ambiguity_ratio` coarse-to-fine scoring, see
+    `compute_timed_scene_centroids_for_videos`.
+
+    A video that can't be scored doesn't fail the others, see
+    `compute_timed_scene_centroids_for_videos`.
+
+    Returns:
+        list: The boxes of each video, in the order of `video_paths`, or None for a
+        video that failed, with the error in its `stats` entry.
+    """
+    for _, mode in outputs:
+        assert mode in BBOX_MODES, f"mode must be one of {BBOX_MODES}"
+
+    if model is None:
+        model = load_tased_model(device, precision=precision)
+
+    scene_outputs = [output for output in outputs if output[1] == SCENE_MODE]
+    tracking_outputs = [output for output in outputs if output[1] == TRACKING_MODE]
+    aspect_ratios = {output: parse_aspect_ratio(output[0]) for output in outputs}
+    video_boxes = []
+    stats = [] if stats is None else stats
+    # stats of the first video of this call
+    first_stats = len(stats)
+
+    def open_videos():
+        for video_path in video_paths:
+            video_boxes.append({output: [] for output in outputs})
+            yield video_path
+
+    for video_num, (
         timestamps,
         scene_centroids,
         tracking_timestamps,
         tracking_centroids,
-    ) in compute_timed_scene_centroids(
-        video_path,
+    ) in compute_timed_scene_centroids_for_videos(
+        open_videos(),
         model,
         step_size=step_size,
         temporal_len=temporal_len,
@@ -718,60 +2068,129 @@ def compute_portrait_square_bboxes_with_scenes(
         kernel_size=kernel_size,
         min_intensity=min_intensity,
         threshold=threshold,
+        batch_size=batch_size,
+        precision=precision,
+        tracking=bool(tracking_outputs),
+        skip_threshold=skip_threshold,
+        max_skip=max_skip,
+        coarse_size=coarse_size,
+        ambiguity_ratio=ambiguity_ratio,
+        num_workers=num_workers,
+        scene_frame_skip=scene_frame_skip,
+        stats=stats,
     ):
-        new_width = 224 * 16 / 9
-        for i, (start, end) in enumerate(zip(timestamps[:-1], timestamps[1:])):
-            # These magic numbers are used to convert 224x384 (7/12 aspect ratio) to 224x398 (16/9 aspect ratio)
-            # before computing the normalized bounding box
-            bounding_box = compute_portrait_from_hcenter(
-                scene_centroids[i][0, 0], (224, new_width)
-            )
-            normalized_bbox = normalize_bbox(bounding_box, (224, new_width))
-            portrait_scene_boxes.append(
-                BBox(start, end, normalized_bbox, is_scene_boundary=i == 0)
-            )
-            square_bounding_box = compute_portrait_from_hcenter(
-                scene_centroids[i][0, 0], (224, new_width), new_aspect_ratio=1
-            )
-            normalized_bbox = normalize_bbox(square_bounding_box, (224, new_width))
-            square_scene_boxes.append(
-                BBox(start, end, normalized_bbox, is_scene_boundary=i == 0)
-            )
-
-        # This looks moronically repetitive, but it's actually necessary because the tracking
-        # timestamps don't correspond to the scene timestamps
-
-        # extract hcenters
-        hcenters = [centroid[0] for centroid in tracking_centroids[0]]
-
-        # compute turning points
-        turning_point_inds = compute_turning_points(hcenters)
-        tp_timestamps = tracking_timestamps[turning_point_inds]
-
-        for i, (start, end) in enumerate(zip(tp_timestamps[:-1], tp_timestamps[1:])):
-            hcenter = hcenters[turning_point_inds[i]]
-            bounding_box = compute_portrait_from_hcenter(hcenter, (224, new_width))
-            normalized_bbox = normalize_bbox(bounding_box, (224, new_width))
+        boxes = video_boxes[video_num]
+        video_stats = stats[first_stats + video_num]
+        if "error" in video_stats:
+            continue
+        try:
+            with StageStats(video_stats["stages"]).measure("boxes"):
+                # These magic numbers are used to convert 224x384 (7/12 aspect ratio) to 224x398 (16/9 aspect ratio)
+                # before computing the normalized bounding box
+                new_width = 224 * 16 / 9
+                for i, (start, end) in enumerate(zip(timestamps[:-1], timestamps[1:])):
+                    for output in scene_outputs:
+                        bounding_box = compute_portrait_from_hcenter(
+                            scene_centroids[i][0, 0],
+                            (224, new_width),
+                            new_aspect_ratio=aspect_ratios[output],
+                        )
+                        normalized_bbox = normalize_bbox(bounding_box, (224, new_width))
+                        boxes[output].append(
+                            BBox(start, end, normalized_bbox, is_scene_boundary=i == 0)
+                        )
+
+                if not tracking_outputs:
+                    continue
+
+                # This looks moronically repetitive, but it's actually necessary because the tracking
+                # timestamps don't correspond to the scene timestamps
+
+                # extract hcenters
+                hcenters = [centroid[0] for centroid in tracking_centroids[0]]
+
+                # compute turning points
+                turning_point_inds = compute_turning_points(hcenters)
+                tp_timestamps = tracking_timestamps[turning_point_inds]
+
+                tp_bounds = zip(tp_timestamps[:-1], tp_timestamps[1:])
+                for i, (start, end) in enumerate(tp_bounds):
+                    hcenter = hcenters[turning_point_inds[i]]
+                    for output in tracking_outputs:
+                        bounding_box = compute_portrait_from_hcenter(
+                            hcenter,
+                            (224, new_width),
+                            new_aspect_ratio=aspect_ratios[output],
+                        )
+                        normalized_bbox = normalize_bbox(bounding_box, (224, new_width))
+                        boxes[output].append(BBox(start, end, normalized_bbox, False))
+        except Exception as e:
+            print(f"Failed to compute the boxes of video {video_num}: {e!r}")
+            video_stats["error"] = repr(e)
+
+    for video_num, boxes in enumerate(video_boxes):
+        video_stats = stats[first_stats + video_num]
+        if "error" in video_stats:
+            video_boxes[video_num] = None
+            continue
+        with StageStats(video_stats["stages"]).measure("boxes"):
+            for output in scene_outputs:
+                boxes[output] = post_process_scene_bboxes(
+                    boxes[output], min_scene_len=min_scene_len
+                )
+    return video_boxes
 
-            portrait_tracking_boxes.append(BBox(start, end, normalized_bbox, False))
 
-            square_bounding_box = compute_portrait_from_hcenter(
-                hcenter,
-                (224, new_width),
-                new_aspect_ratio=1,
-            )
-            normalized_bbox = normalize_bbox(square_bounding_box, (224, new_width))
-            square_tracking_boxes.append(BBox(start, end, normalized_bbox, False))
+def compute_portrait_square_bboxes_with_scenes(
+    video_path,
+    model = None,
+    step_size=32,
+    temporal_len=32,
+    progress_bar=False,
+    kernel_size=3,
+    min_intensity=50,
+    threshold=40,
+    min_scene_len=1,
+    batch_size=4,
+    precision="fp32",
+    skip_threshold=0.0,
+    max_skip=4,
+    coarse_size=None,
+    ambiguity_ratio=0.9,
+    num_workers=1,
+    scene_frame_skip=0,
+) -> tuple[list, list, list, list]:
+    """Compute square and portrait boxes in both scene and tracking mode.
 
-    portrait_scene_boxes = post_process_scene_bboxes(
-        portrait_scene_boxes, min_scene_len=min_scene_len
-    )
-    square_bounding_box = post_process_scene_bboxes(
-        square_scene_boxes, min_scene_len=min_scene_len
-    )
-    return (
-        square_scene_boxes,
-        portrait_scene_boxes,
-        square_tracking_boxes,
-        portrait_tracking_boxes,
+    Returns:
+        A (square_scene_boxes, portrait_scene_boxes, square_tracking_boxes,
+        portrait_tracking_boxes) tuple. Use `compute_bboxes_with_scenes` to compute
+        only some of these.
+    """
+    outputs = [
+        (1, SCENE_MODE),
+        (9 / 16, SCENE_MODE),
+        (1, TRACKING_MODE),
+        (9 / 16, TRACKING_MODE),
+    ]
+    boxes = compute_bboxes_with_scenes(
+        video_path,
+        outputs,
+        model=model,
+        step_size=step_size,
+        temporal_len=temporal_len,
+        progress_bar=progress_bar,
+        kernel_size=kernel_size,
+        min_intensity=min_intensity,
+        threshold=threshold,
+        min_scene_len=min_scene_len,
+        batch_size=batch_size,
+        precision=precision,
+        skip_threshold=skip_threshold,
+        max_skip=max_skip,
+        coarse_size=coarse_size,
+        ambiguity_ratio=ambiguity_ratio,
+        num_workers=num_workers,
+        scene_frame_skip=scene_frame_skip,
     )
+    return tuple(boxes[output] for output in outputs)
@@ -0,0 +1,92 @@
+"""Per-stage cost accounting for the saliency worker.
+
+A `StageStats` accumulates the wall time, CPU time, frames, bytes read and peak memory
+of every stage of a video (download, probe, decode, scene detection, inference, ...)
+into a plain JSON-serializable dict, so it can be returned in the job output as is.
+"""
+import resource
+import time
+from contextlib import contextmanager, nullcontext
+
+
+def peak_rss_mb() -> float:
+    """High-water mark of the resident memory of this process, in MiB."""
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class StageStats:
+    """Accumulated cost of the stages of one video.
+
+    Every stage maps to a dict of `wall_seconds`, `cpu_seconds`, `frames`,
+    `bytes_read` and `peak_rss_mb`. CPU time is that of the Python thread running the
+    stage, so native thread pools (decoder threads, intra-op threads) are not included.
+    Peak RSS is the process high-water mark at the end of the stage, so it also covers
+    whatever ran alongside it.
+
+    Stages may run on different threads, as long as each stage only runs on one.
+
+    Args:
+        stages (dict): The dict to accumulate into, e.g. one that is already part of a
+            stats dict. A new one by default.
+    """
+
+    def __init__(self, stages=None):
+        self.stages = {} if stages is None else stages
+
+    def add(self, stage, wall_seconds=0.0, cpu_seconds=0.0, frames=0, bytes_read=0):
+        entry = self.stages.get(stage)
+        if entry is None:
+            entry = self.stages[stage] = {
+                "wall_seconds": 0.0,
+                "cpu_seconds": 0.0,
+                "frames": 0,
+                "bytes_read": 0,
+                "peak_rss_mb": 0.0,
+            }
+        entry["wall_seconds"] += wall_seconds
+        entry["cpu_seconds"] += cpu_seconds
+        entry["frames"] += frames
+        entry["bytes_read"] += bytes_read
+        entry["peak_rss_mb"] = max(entry["peak_rss_mb"], peak_rss_mb())
+
+    @contextmanager
+    def measure(self, stage, frames=0, bytes_read=0):
+        wall_start = time.perf_counter()
+        cpu_start = time.thread_time()
+        try:
+            yield
+        finally:
+            self.add(
+                stage,
+                wall_seconds=time.perf_counter() - wall_start,
+                cpu_seconds=time.thread_time() - cpu_start,
+                frames=frames,
+                bytes_read=bytes_read,
+            )
+
+    def merge(self, stages, share=1.0):
+        """Add the stages of another `StageStats`, e.g. one of a worker process.
+
+        Args:
+            share (float): The fraction of the other stages' cost to add, for work that
+                was shared between several videos.
+        """
+        for stage, entry in stages.items():
+            self.add(
+                stage,
+                wall_seconds=entry["wall_seconds"] * share,
+                cpu_seconds=entry["cpu_seconds"] * share,
+                frames=round(entry["frames"] * share),
+                bytes_read=round(entry["bytes_read"] * share),
+            )
+            self.stages[stage]["peak_rss_mb"] = max(
+                self.stages[stage]["peak_rss_mb"], entry["peak_rss_mb"]
+            )
+
+
+def measure(stage_stats, stage, frames=0, bytes_read=0):
+    """Measure a stage into `stage_stats`, or do nothing if it is None."""
+    if stage_stats is None:
+        return nullcontext()
+    return stage_stats.measure(stage, frames=frames, bytes_read=bytes_read)
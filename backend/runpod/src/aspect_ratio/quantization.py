@@ -0,0 +1,154 @@
+"""INT8 quantization of the TASED saliency model and precision drift reports.
+
+Calibrate a statically quantized model from a set of reference videos and save it
+next to the fp32 weights, where `load_tased_model(precision="int8")` picks it up:
+
+    python -m aspect_ratio.quantization calibrate video1.mp4 video2.mp4 ...
+
+Compare the crop centroids of a reduced-precision mode against fp32:
+
+    python -m aspect_ratio.quantization report --precision int8 video1.mp4 ...
+"""
+import argparse
+import copy
+import itertools
+import json
+import os
+
+import numpy as np
+import torch
+from torch.ao.quantization import get_default_qconfig_mapping
+from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+from aspect_ratio.conversion import (
+    PRECISIONS,
+    TASED_INT8_WEIGHT_FILE,
+    _scene_clips,
+    compute_timed_scene_centroids,
+    decode_frames_with_scenes,
+    load_tased_model,
+)
+from aspect_ratio.tased_net import fuse_for_inference
+
+
+# width of the saliency maps the centroids are measured in
+SALIENCY_WIDTH = 384
+
+
+def calibration_clips(video_paths, clips_per_video=8, step_size=32, temporal_len=32):
+    """Yield clips spread evenly over each video, as they are fed to the model."""
+    import decord
+
+    decord.bridge.set_bridge("torch")
+
+    for video_path in video_paths:
+        reader = decord.VideoReader(
+            video_path, ctx=decord.cpu(), width=384, height=224, num_threads=0
+        )
+        stride = max(len(reader) // step_size // clips_per_video, 1)
+        frames = decode_frames_with_scenes(reader, reader.get_avg_fps())
+        clips = _scene_clips(frames, [], step_size=step_size, temporal_len=temporal_len)
+        for _, window in itertools.islice(clips, 0, stride * clips_per_video, stride):
+            yield window.to_clip()
+
+
+def quantize_tased_model(model, clips, input_shape=(1, 3, 32, 224, 384)):
+    """Statically quantize the convolutions of an eval-mode TASED_v2 to INT8.
+
+    Pooling layers that return indices and the unpooling layers stay in fp32.
+
+    Args:
+        model: The fp32 model, left untouched.
+        clips: An iterable of calibration clips of shape (1, 3, T, H, W).
+        input_shape: The (B, 3, T, H, W) shape of the clip used for tracing.
+
+    Returns:
+        A frozen TorchScript module that runs on CPU.
+    """
+    model = fuse_for_inference(copy.deepcopy(model).cpu())
+    qconfig_mapping = get_default_qconfig_mapping("fbgemm")
+    for name, module in model.named_modules():
+        if isinstance(module, torch.nn.MaxPool3d) and module.return_indices:
+            qconfig_mapping.set_module_name(name, None)
+
+    example = torch.rand(input_shape) * 2 - 1
+    prepared = prepare_fx(model, qconfig_mapping, (example,))
+    with torch.no_grad():
+        for clip in clips:
+            prepared(clip)
+
+    quantized = convert_fx(prepared)
+    with torch.no_grad():
+        return torch.jit.freeze(torch.jit.trace(quantized, example))
+
+
+def centroid_drift(video_path, reference_model, model, precision, batch_size=4):
+    """Measure how far the crop centroids of `model` move from `reference_model`.
+
+    Returns:
+        dict: Per-frame horizontal drift statistics, in saliency map pixels.
+    """
+
+    def hcenters(model, precision):
+        return np.concatenate(
+            [
+                np.concatenate(scene_centroids)[:, 0]
+                for _, scene_centroids, _, _ in compute_timed_scene_centroids(
+                    video_path, model, batch_size=batch_size, precision=precision
+                )
+            ]
+        )
+
+    drift = np.abs(hcenters(model, precision) - hcenters(reference_model, "fp32"))
+    return {
+        "video": os.path.basename(video_path),
+        "frames": len(drift),
+        "mean_px": float(drift.mean()),
+        "p95_px": float(np.percentile(drift, 95)),
+        "max_px": float(drift.max()),
+        "max_width_fraction": float(drift.max() / SALIENCY_WIDTH),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    calibrate = subparsers.add_parser("calibrate", help="build the INT8 model")
+    calibrate.add_argument("videos", nargs="+")
+    calibrate.add_argument("--clips-per-video", type=int, default=8)
+    calibrate.add_argument("--output", default=TASED_INT8_WEIGHT_FILE)
+
+    report = subparsers.add_parser("report", help="compare centroids against fp32")
+    report.add_argument("videos", nargs="+")
+    report.add_argument("--precision", choices=PRECISIONS[1:], default="int8")
+    report.add_argument("--output", help="write the report as JSON to this path")
+
+    args = parser.parse_args()
+    reference_model = load_tased_model("cpu")
+
+    if args.command == "calibrate":
+        clips = calibration_clips(args.videos, clips_per_video=args.clips_per_video)
+        quantized = quantize_tased_model(reference_model, clips)
+        torch.jit.save(quantized, args.output)
+        print(f"saved int8 model to {args.output}")
+        return
+
+    model = load_tased_model("cpu", precision=args.precision)
+    rows = [
+        centroid_drift(video_path, reference_model, model, args.precision)
+        for video_path in args.videos
+    ]
+    print(f"{'video':<40} {'frames':>7} {'mean px':>8} {'p95 px':>8} {'max px':>8}")
+    for row in rows:
+        print(
+            f"{row['video']:<40} {row['frames']:>7} {row['mean_px']:>8.2f} "
+            f"{row['p95_px']:>8.2f} {row['max_px']:>8.2f}"
+        )
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump({"precision": args.precision, "videos": rows}, file, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""Array-only smoothing and interpolation of saliency centroids.
+
+Every function works on whole NumPy arrays, so post-processing a scene costs a few
+vectorized passes whether it has a handful of clip centroids or one per frame.
+
+Gaps are interpolated in float64, whereas the torch code this replaced interpolated with
+float32 `torch.linspace` weights. The results are therefore not bit-identical to the old
+ones. Upsampled centroids differ by about one float32 ulp, and smoothed centroids
+occasionally differ by a few 1e-7 px.
+"""
+import numpy as np
+
+
+def interpolate_gaps(values: np.ndarray, valid: np.ndarray) -> np.ndarray:
+    """Linearly interpolate the rows of `values` in between the `valid` rows.
+
+    Rows before the first and after the last valid row repeat the nearest valid row.
+
+    Args:
+        values: An array of shape (N, D).
+        valid: A boolean mask of shape (N,) marking the rows to interpolate between.
+
+    Returns:
+        np.ndarray: A float64 array of shape (N, D).
+    """
+    valid_indices = np.flatnonzero(valid)
+    if len(valid_indices) == 0:
+        return values.astype(np.float64)
+
+    positions = np.arange(len(values))
+    return np.column_stack(
+        [
+            np.interp(positions, valid_indices, values[valid_indices, dim])
+            for dim in range(values.shape[1])
+        ]
+    )
+
+
+def upsample_centroids(centroids, step_size) -> np.ndarray:
+    """Interpolate centroids to match the original frame rate.
+
+    Args:
+        centroids: A list or ndarray of centroids.
+        step_size: The number of frames in between each centroid.
+
+    Returns:
+        np.ndarray: A float32 array of shape (len(centroids) * step_size, 2) containing
+        the upsampled centroids.
+    """
+    centroids = np.asarray(centroids, dtype=np.float32)
+    valid = np.zeros(len(centroids) * step_size, dtype=bool)
+    valid[::step_size] = True
+
+    upsampled_centroids = np.empty((len(valid), 2), dtype=np.float32)
+    upsampled_centroids[valid] = centroids
+    return interpolate_gaps(upsampled_centroids, valid).astype(np.float32)
+
+
+def segment_clusters(centroids: np.ndarray, threshold) -> np.ndarray:
+    """Split a sequence of centroids wherever consecutive centroids are far apart.
+
+    Returns:
+        np.ndarray: The start index of every cluster, beginning with 0.
+    """
+    distances = np.sqrt(np.sum(np.diff(centroids, axis=0) ** 2, axis=1))
+    return np.concatenate([[0], np.flatnonzero(distances > threshold) + 1])
+
+
+def segment_medians(values: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    """Compute the per-column median of every segment of `values`.
+
+    Args:
+        values: An array of shape (N, D).
+        starts: The sorted start index of every segment, beginning with 0.
+
+    Returns:
+        np.ndarray: An array of shape (len(starts), D), equal to `np.median` of each segment.
+    """
+    lengths = np.diff(np.append(starts, len(values)))
+    segment_ids = np.repeat(np.arange(len(starts)), lengths)
+    lower = starts + (lengths - 1) // 2
+    upper = starts + lengths // 2
+
+    medians = np.empty((len(starts), values.shape[1]))
+    for dim in range(values.shape[1]):
+        # sort each column within its segment, segments stay in place
+        column = values[np.lexsort((values[:, dim], segment_ids)), dim]
+        medians[:, dim] = (column[lower] + column[upper]) / 2
+    return medians
+
+
+def compute_smoothed_centroids(
+    centroids: list[np.ndarray] | np.ndarray,
+    step_size,
+    cluster_threshold=25,
+    smoothing_threshold=10,
+):
+    """Compute smoothed centroids from a list of centroids.
+
+    Consecutive centroids closer than `cluster_threshold` are clustered and replaced by
+    their median, tiled over the cluster's frames. If the next cluster's median is within
+    `smoothing_threshold`, the cluster instead ramps linearly towards it.
+
+    Args:
+        centroids: A list of centroids.
+        cluster_threshold: The maximum distance between two centroids to be considered part of the same cluster.
+        smoothing_threshold: The maximum distance between two centroids to be collapsed into a single centroid.
+
+    Returns:
+        list: An array of shape (len(cluster) * step_size, 2) per cluster.
+    """
+    centroids = np.asarray(centroids, dtype=np.float64)
+    starts = segment_clusters(centroids, cluster_threshold)
+    medians = segment_medians(centroids, starts)
+
+    lengths = np.diff(np.append(starts, len(centroids))) * step_size
+    ends = np.cumsum(lengths)
+    firsts = ends - lengths
+
+    # a cluster ends on the next cluster's median when the two are close, and on its
+    # own median otherwise; the last cluster is always constant
+    distances = np.linalg.norm(medians[1:] - medians[:-1], axis=1)
+    smoothed = np.append(distances <= smoothing_threshold, False)
+    next_medians = np.concatenate([medians[1:], medians[-1:]])
+    end_values = np.where(smoothed[:, None], next_medians, medians)
+    # a single frame cluster only holds its end value
+    start_values = np.where((lengths == 1)[:, None], end_values, medians)
+
+    knots = np.stack([firsts, ends - 1], axis=1).ravel()
+    knot_values = np.stack([start_values, end_values], axis=1).reshape(-1, 2)
+    # single frame clusters have a single knot
+    keep = np.stack([np.ones(len(lengths), dtype=bool), lengths > 1], axis=1).ravel()
+
+    positions = np.arange(ends[-1])
+    tiled_median_centroids = np.column_stack(
+        [
+            np.interp(positions, knots[keep], knot_values[keep, dim])
+            for dim in range(2)
+        ]
+    )
+    return np.split(tiled_median_centroids, ends[:-1])
@@ -1,5 +1,6 @@
 import torch
 from torch import nn
+from torch.nn.utils.fusion import fuse_conv_bn_eval
 
 
 class TASED_v2(nn.Module):
@@ -471,3 +472,78 @@ class Mixed_5c(nn.Module):
         x3 = self.branch3(x)
         out = torch.cat((x0, x1, x2, x3), 1)
         return out
+
+
+def fold_batch_norms(module: nn.Module) -> nn.Module:
+    """Fold every BatchNorm3d into the convolution that precedes it, in place.
+
+    The model must be in eval mode, since the running statistics are baked into the
+    convolution weights. Folded BatchNorms are replaced with `nn.Identity`.
+    """
+    for child in module.children():
+        fold_batch_norms(child)
+
+    if isinstance(module, BasicConv3d):
+        module.conv = fuse_conv_bn_eval(module.conv, module.bn)
+        module.bn = nn.Identity()
+    elif isinstance(module, SepConv3d):
+        module.conv_s = fuse_conv_bn_eval(module.conv_s, module.bn_s)
+        module.bn_s = nn.Identity()
+        module.conv_t = fuse_conv_bn_eval(module.conv_t, module.bn_t)
+        module.bn_t = nn.Identity()
+    elif isinstance(module, nn.Sequential):
+        for i in range(len(module) - 1):
+            conv, bn = module[i], module[i + 1]
+            if not isinstance(bn, nn.BatchNorm3d):
+                continue
+            if isinstance(conv, nn.ConvTranspose3d):
+                module[i] = fuse_conv_bn_eval(conv, bn, transpose=True)
+                module[i + 1] = nn.Identity()
+            elif isinstance(conv, nn.Conv3d):
+                module[i] = fuse_conv_bn_eval(conv, bn)
+                module[i + 1] = nn.Identity()
+
+    return module
+
+
+class TraceableMaxUnpool3d(nn.MaxUnpool3d):
+    """MaxUnpool3d that can be traced.
+
+    `F.max_unpool3d` validates the output size with Python comparisons, which fail when
+    the sizes are traced values. This computes the same output size and calls the aten
+    op directly. Freezing the traced graph still folds the output size of the example
+    input into it, so a frozen graph only accepts inputs of the size it was traced with.
+    """
+
+    def forward(self, input, indices, output_size=None):
+        if output_size is None:
+            output_size = [
+                (input.size(d + 2) - 1) * self.stride[d]
+                - 2 * self.padding[d]
+                + self.kernel_size[d]
+                for d in range(3)
+            ]
+        else:
+            output_size = output_size[-3:]
+        return torch.ops.aten.max_unpool3d(
+            input, indices, output_size, self.stride, self.padding
+        )
+
+
+def fuse_for_inference(model: TASED_v2) -> TASED_v2:
+    """Prepare an eval-mode TASED_v2 for tracing, in place.
+
+    BatchNorms are folded into their convolutions and the unpooling layers are
+    swapped for traceable equivalents.
+    """
+    fold_batch_norms(model)
+    for name in ("unpool1", "unpool2", "unpool3"):
+        unpool = getattr(model, name)
+        setattr(
+            model,
+            name,
+            TraceableMaxUnpool3d(
+                unpool.kernel_size, stride=unpool.stride, padding=unpool.padding
+            ),
+        )
+    return model
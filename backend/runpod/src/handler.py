@@ -1,54 +1,314 @@
+from concurrent.futures import ThreadPoolExecutor
+import json
 import os
+import time
 from tempfile import NamedTemporaryFile, gettempdir
 
 import runpod
 import requests
 
+from aspect_ratio.cache import SaliencyCache, file_digest, result_version
+from aspect_ratio.instrumentation import StageStats, peak_rss_mb
 from aspect_ratio.conversion import (
+    TASED_INT8_WEIGHT_FILE,
+    TASED_WEIGHT_FILE,
+    SCENE_MODE,
     load_tased_model,
+    is_traced_model,
+    warm_up_tased_model,
     device,
-    compute_portrait_square_bboxes_with_scenes,
+    compute_bboxes_for_videos,
 )
 
 
+# size of the reads and writes while streaming a download
+DOWNLOAD_CHUNK_SIZE = 1 << 20
+
+# downloads of at least this many bytes are split into parallel range requests
+# when the server supports them
+RANGE_DOWNLOAD_MIN_BYTES = 8 << 20
+RANGE_DOWNLOAD_PARTS = int(os.getenv("RANGE_DOWNLOAD_PARTS", 4))
+
+
+def _download_range(url, path, start, end):
+    response = requests.get(url, headers={"Range": f"bytes={start}-{end}"}, stream=True)
+    if response.status_code != 206:
+        raise ValueError("Unable to download the video")
+
+    with open(path, "r+b") as file:
+        file.seek(start)
+        for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+            file.write(chunk)
+        if file.tell() != end + 1:
+            raise ValueError("Incomplete video download")
+
+
 def download_video(url):
     response = requests.get(url, stream=True)
     if not response.ok:
         raise ValueError("Unable to download the video")
 
+    size = int(response.headers.get("Content-Length", 0))
+    use_ranges = (
+        RANGE_DOWNLOAD_PARTS > 1
+        and size >= RANGE_DOWNLOAD_MIN_BYTES
+        and response.headers.get("Accept-Ranges") == "bytes"
+        and "Content-Encoding" not in response.headers
+    )
+
     # Create a temporary file
     with NamedTemporaryFile(delete=False, suffix=".mp4", dir=gettempdir()) as temp_file:
-        # Write the video content to the temporary file
-        for chunk in response.iter_content(chunk_size=1024):
-            if chunk:
+        if not use_ranges:
+            # Write the video content to the temporary file
+            for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
                 temp_file.write(chunk)
 
-        # Return the full path of the downloaded file
-        return os.path.join(gettempdir(), temp_file.name)
+            # Return the full path of the downloaded file
+            return os.path.join(gettempdir(), temp_file.name)
+
+        # preallocate the file so every part can be written in place
+        response.close()
+        temp_file.truncate(size)
+
+    part_size = -(-size // RANGE_DOWNLOAD_PARTS)
+    with ThreadPoolExecutor(RANGE_DOWNLOAD_PARTS) as executor:
+        parts = [
+            executor.submit(
+                _download_range,
+                url,
+                temp_file.name,
+                start,
+                min(start + part_size, size) - 1,
+            )
+            for start in range(0, size, part_size)
+        ]
+        for part in parts:
+            part.result()
+
+    return os.path.join(gettempdir(), temp_file.name)
+
+
+TASED_ENGINE = os.getenv("TASED_ENGINE", "eager")
+TASED_PRECISION = os.getenv("TASED_PRECISION", "fp32")
+
+# windows whose frames differ from the last scored window of their scene by less than
+# this many 8-bit levels on average reuse its centroid, at most SALIENCY_MAX_SKIP in a
+# row; 0 scores every window
+SALIENCY_SKIP_THRESHOLD = float(os.getenv("SALIENCY_SKIP_THRESHOLD", 2.0))
+SALIENCY_MAX_SKIP = int(os.getenv("SALIENCY_MAX_SKIP", 4))
+
+# CPU processes scoring scenes in parallel, each with an equal share of the cores
+SALIENCY_WORKERS = int(os.getenv("SALIENCY_WORKERS", 1))
+
+# "WIDTHxHEIGHT" (multiples of 32) windows are scored at first, only windows whose
+# saliency map has two similarly salient components are scored again at 384x224;
+# empty scores every window at 384x224. Only the eager engine supports it
+SALIENCY_COARSE_SIZE = os.getenv("SALIENCY_COARSE_SIZE", "224x128")
+coarse_size = None
+if SALIENCY_COARSE_SIZE:
+    width, height = SALIENCY_COARSE_SIZE.split("x")
+    coarse_size = (int(height), int(width))
+SALIENCY_AMBIGUITY_RATIO = float(os.getenv("SALIENCY_AMBIGUITY_RATIO", 0.9))
+
+# the scene detector only sees every SCENE_FRAME_SKIP + 1th frame, downscaled, cuts
+# are refined back to the exact frame; 0 runs it on every frame
+SCENE_FRAME_SKIP = int(os.getenv("SCENE_FRAME_SKIP", 2))
+
+# spawned scene worker processes run this module again under another name, they load
+# their own model
+if __name__ == "__main__":
+    model = load_tased_model(device, engine=TASED_ENGINE, precision=TASED_PRECISION)
+    if coarse_size is not None and is_traced_model(model):
+        # traced graphs only accept the 384x224 windows they were traced with
+        print("Coarse scoring needs the eager model, scoring every window at 384x224")
+        coarse_size = None
+    # run one blank batch at boot so the first job doesn't pay for the first forward
+    # pass
+    if os.getenv("TASED_WARM_UP", "1") == "1":
+        warm_up_tased_model(model, precision=TASED_PRECISION, coarse_size=coarse_size)
+
+# bump when the conversion pipeline changes its output for the same model
+SALIENCY_PIPELINE_VERSION = 1
 
+weight_file = TASED_INT8_WEIGHT_FILE if TASED_PRECISION == "int8" else TASED_WEIGHT_FILE
+result_cache_version = result_version(
+    pipeline=SALIENCY_PIPELINE_VERSION,
+    weights=file_digest(weight_file) if os.path.isfile(weight_file) else None,
+    engine=TASED_ENGINE,
+    precision=TASED_PRECISION,
+    skip_threshold=SALIENCY_SKIP_THRESHOLD,
+    max_skip=SALIENCY_MAX_SKIP,
+    coarse_size=coarse_size,
+    ambiguity_ratio=SALIENCY_AMBIGUITY_RATIO,
+    scene_frame_skip=SCENE_FRAME_SKIP,
+    # skipping restarts at every worker task
+    workers=SALIENCY_WORKERS,
+)
+
+result_cache = SaliencyCache(
+    os.getenv("SALIENCY_CACHE_DIR", os.path.join(gettempdir(), "saliency_cache")),
+    max_bytes=int(os.getenv("SALIENCY_CACHE_MAX_BYTES", 1 << 30)),
+)
+
+
+# maximum number of videos of a batch job downloaded at once
+MAX_CONCURRENT_DOWNLOADS = int(os.getenv("MAX_CONCURRENT_DOWNLOADS", 8))
+
+# print the stats of every video and job as a JSON line, for log-based metrics
+STATS_LOG_JSON = os.getenv("STATS_LOG_JSON", "0") == "1"
+
+
+def timed_download(url):
+    """Download a video, measuring it as the "download" stage of a new `StageStats`."""
+    stage_stats = StageStats()
+    with stage_stats.measure("download"):
+        video_path = download_video(url)
+    stage_stats.add("download", bytes_read=os.path.getsize(video_path))
+    return video_path, stage_stats
+
+
+def iter_downloads(urls):
+    """Download several videos concurrently.
 
-model = load_tased_model(device)
+    Yields:
+        A (url, path, stage_stats) tuple per video in the order of `urls` as soon as it
+        has been downloaded, with a path and stats of None if the download failed.
+    """
+
+    def try_download(url):
+        try:
+            return timed_download(url)
+        except Exception as e:
+            print(f"Failed to download {url}: {e}")
+            return None, None
+
+    if not urls:
+        return
+    with ThreadPoolExecutor(min(len(urls), MAX_CONCURRENT_DOWNLOADS)) as executor:
+        downloads = [executor.submit(try_download, url) for url in urls]
+        for url, download in zip(urls, downloads):
+            yield url, *download.result()
 
 
 def handler(job):
-    """Handler function that will be used to process jobs."""
+    """Handler function that will be used to process jobs.
+
+    The input holds either a single `video_url`, returning its boxes, or a list of
+    `video_urls`, returning a list with the boxes of each video (None for videos that
+    could not be downloaded or scored, which don't fail the rest of the job). All
+    videos of a job share the model's batches.
+
+    With `include_stats`, the output is a dict of the boxes, the sampling stats and
+    per-stage costs of each video, and the totals of the job instead.
+    """
+    job_start = time.perf_counter()
+    job_cpu_start = time.process_time()
     job_input = job["input"]
 
+    video_urls = job_input.get("video_urls")
     video_url = job_input.get("video_url")
-    if not video_url:
-        raise ValueError("video_url is required")
+    if not video_urls and not video_url:
+        raise ValueError("video_url or video_urls is required")
+
+    # optional list of "width:height" ratios, e.g. ["9:16", "4:5"]; without it only the
+    # 9:16 scene boxes are computed and returned as a plain list
+    aspect_ratios = job_input.get("aspect_ratios")
+    outputs = [(aspect_ratio, SCENE_MODE) for aspect_ratio in aspect_ratios or [9 / 16]]
+    version = result_version(version=result_cache_version, aspect_ratios=aspect_ratios)
+
+    if video_urls:
+        downloads = iter_downloads(video_urls)
+    else:
+        downloads = [(video_url, *timed_download(video_url))]
+
+    results = {}
+    urls = {}
+    cache_keys = {}
+    stats = {}
+    download_stats = {}
+    missing = []
+
+    def uncached_videos():
+        # videos are scored as soon as they are downloaded, while the rest of the
+        # batch is still downloading
+        for i, (url, video_path, stage_stats) in enumerate(downloads):
+            results[i] = None
+            urls[i] = url
+            if video_path is None:
+                continue
+            download_stats[i] = stage_stats
+            with stage_stats.measure(
+                "cache_lookup", bytes_read=os.path.getsize(video_path)
+            ):
+                cache_keys[i] = result_cache.key(video_path, version)
+                results[i] = result_cache.get(cache_keys[i])
+            if results[i] is not None:
+                print(f"Cache hit for {url}: {cache_keys[i]}")
+                stats[i] = {"cached": True, "stages": stage_stats.stages}
+                continue
+            missing.append(i)
+            yield video_path
+
+    video_stats = []
+    video_boxes = compute_bboxes_for_videos(
+        uncached_videos(),
+        outputs,
+        model=model,
+        precision=TASED_PRECISION,
+        skip_threshold=SALIENCY_SKIP_THRESHOLD,
+        max_skip=SALIENCY_MAX_SKIP,
+        coarse_size=coarse_size,
+        ambiguity_ratio=SALIENCY_AMBIGUITY_RATIO,
+        scene_frame_skip=SCENE_FRAME_SKIP,
+        stats=video_stats,
+        num_workers=SALIENCY_WORKERS,
+    )
+    for i, boxes, sampling_stats in zip(missing, video_boxes, video_stats):
+        stats[i] = {
+            "cached": False,
+            **sampling_stats,
+            "stages": {**download_stats[i].stages, **sampling_stats["stages"]},
+        }
+        if boxes is None:
+            if not video_urls:
+                # like a failed download, a failed single video fails the job
+                raise RuntimeError(f"Failed to score {urls[i]}: {sampling_stats['error']}")
+            print(f"Failed to score {urls[i]}: {sampling_stats['error']}")
+            continue
+        print(
+            f"Skipped {sampling_stats['skip_ratio']:.0%} and refined "
+            f"{sampling_stats['refine_ratio']:.0%} of the windows of {urls[i]}"
+        )
+        if aspect_ratios:
+            results[i] = {
+                aspect_ratio: [bbox._asdict() for bbox in boxes[(aspect_ratio, SCENE_MODE)]]
+                for aspect_ratio in aspect_ratios
+            }
+        else:
+            results[i] = [bbox._asdict() for bbox in boxes[outputs[0]]]
+        result_cache.put(cache_keys[i], results[i])
 
-    video_path = download_video(video_url)
+    job_stats = {
+        "videos": len(results),
+        "wall_seconds": time.perf_counter() - job_start,
+        "cpu_seconds": time.process_time() - job_cpu_start,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    if STATS_LOG_JSON:
+        for i, video_stats in stats.items():
+            log = {"job_id": job.get("id"), "video_url": urls[i], **video_stats}
+            print(json.dumps(log))
+        print(json.dumps({"job_id": job.get("id"), **job_stats}))
 
-    (
-        _,
-        portrait_scene_boxes,
-        _,
-        _,
-    ) = compute_portrait_square_bboxes_with_scenes(video_path, model=model)
+    results = [results[i] for i in range(len(results))]
+    stats = [stats.get(i) for i in range(len(results))]
+    if not job_input.get("video_urls"):
+        results, stats = results[0], stats[0]
 
-    portrait_bounding_boxes = [bbox._asdict() for bbox in portrait_scene_boxes]
-    return portrait_bounding_boxes
+    if job_input.get("include_stats"):
+        return {"boxes": results, "stats": stats, "job": job_stats}
+    return results
 
 
-runpod.serverless.start({"handler": handler})
+if __name__ == "__main__":
+    runpod.serverless.start({"handler": handler})
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the worker runs from src, so its packages are imported from there
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "src"))
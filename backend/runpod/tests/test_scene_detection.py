@@ -0,0 +1,71 @@
+"""Cuts found by the strided in-line scene detector against the full-rate detector."""
+import shutil
+import subprocess
+
+import pytest
+
+decord = pytest.importorskip("decord")
+
+from aspect_ratio.conversion import decode_frames_with_scenes  # noqa: E402
+
+pytestmark = pytest.mark.skipif(
+    shutil.which("ffmpeg") is None, reason="ffmpeg is needed to generate the videos"
+)
+
+SOURCES = ("testsrc2", "smptebars", "mandelbrot")
+
+
+def _cut_video(path, scene_lengths, size="640x360"):
+    """Write a 30 fps video of one synthetic source per scene, `scene_lengths` frames each."""
+    command = ["ffmpeg", "-y", "-loglevel", "error"]
+    for source, _ in zip(SOURCES, scene_lengths):
+        command += ["-f", "lavfi", "-i", f"{source}=s={size}:r=30"]
+    trims = "".join(
+        f"[{i}]trim=end_frame={length},setpts=PTS-STARTPTS[v{i}];"
+        for i, length in enumerate(scene_lengths)
+    )
+    inputs = "".join(f"[v{i}]" for i in range(len(scene_lengths)))
+    command += [
+        "-filter_complex",
+        f"{trims}{inputs}concat=n={len(scene_lengths)}:v=1",
+        "-c:v",
+        "libx264",
+        "-pix_fmt",
+        "yuv420p",
+        # concat drops the rate, the default 25 fps would drop frames
+        "-r",
+        "30",
+        str(path),
+    ]
+    subprocess.run(command, check=True)
+
+
+def _scene_starts(path, frame_skip):
+    reader = decord.VideoReader(
+        str(path), ctx=decord.cpu(), width=384, height=224, num_threads=0
+    )
+    frames = decode_frames_with_scenes(
+        reader, reader.get_avg_fps(), frame_skip=frame_skip
+    )
+    return [frame_num for frame_num, (_, start) in enumerate(frames) if start]
+
+
+@pytest.mark.parametrize(
+    "scene_lengths",
+    [
+        (60, 60, 60),
+        # cuts between the frames a strided detector sees
+        (47, 61, 53),
+        (31, 67),
+    ],
+)
+def test_strided_detection_finds_the_same_cuts(tmp_path, scene_lengths):
+    path = tmp_path / "cuts.mp4"
+    _cut_video(path, scene_lengths)
+    expected = [0]
+    for length in scene_lengths[:-1]:
+        expected.append(expected[-1] + length)
+
+    assert _scene_starts(path, frame_skip=0) == expected
+    for frame_skip in (1, 2, 3, 5):
+        assert _scene_starts(path, frame_skip=frame_skip) == expected, frame_skip
@@ -0,0 +1,86 @@
+"""Property tests of `compute_turning_points` against the original generator."""
+import numpy as np
+import pytest
+
+from aspect_ratio.conversion import compute_turning_points
+
+
+def _compute_turning_points(data, min_change: float = 0.05, max_drift: float = 0.5):
+    """The step by step walk `compute_turning_points` replaced, kept as a reference."""
+    diff = np.diff(data)
+    curr_direction = 0
+    curr_drift = 0
+    yield 0
+    for i, d in enumerate(diff):
+        if abs(curr_drift) > max_drift:
+            curr_direction = np.sign(curr_drift)
+            if curr_direction != 0:
+                curr_drift = 0
+                yield i
+            curr_direction = 0
+        if abs(d) < min_change:
+            if curr_direction != 0:
+                curr_drift = 0
+                yield i
+            curr_direction = 0
+        if d > min_change:
+            if curr_direction != 1:
+                curr_drift = 0
+                yield i
+            curr_direction = 1
+        elif d < -min_change:
+            if curr_direction != -1:
+                curr_drift = 0
+                yield i
+            curr_direction = -1
+        curr_drift += d
+
+    yield len(data) - 1
+
+
+def reference_turning_points(data, min_change=0.15, max_drift=0.5):
+    return sorted(
+        set(_compute_turning_points(data, min_change=min_change, max_drift=max_drift))
+    )
+
+
+def random_signal(rng):
+    """A random signal shaped like the ones the tracking boxes produce."""
+    length = int(rng.integers(1, 400))
+    kind = rng.integers(5)
+    if kind == 0:
+        # per-frame box centers wandering around the frame
+        return np.clip(0.5 + np.cumsum(rng.normal(0, 0.05, length)), 0, 1)
+    if kind == 1:
+        # plateaus joined by jumps, like centroids held between windows
+        values = rng.uniform(0, 1, int(rng.integers(1, 12)))
+        return np.repeat(values, rng.integers(1, 40, len(values)))[:length]
+    if kind == 2:
+        # steps on a coarse grid, so many of them land exactly on the thresholds
+        return np.cumsum(rng.integers(-4, 5, length) * 0.05)
+    if kind == 3:
+        # slow drifts that only ever turn through the accumulated change
+        return np.cumsum(rng.choice([-0.1, 0.0, 0.1], length, p=[0.2, 0.5, 0.3]))
+    return rng.uniform(-1, 1, length).astype(np.float32)
+
+
+@pytest.mark.parametrize("seed", range(200))
+def test_matches_reference(seed):
+    rng = np.random.default_rng(seed)
+    data = random_signal(rng)
+    min_change = float(rng.choice([0.05, 0.1, 0.15, rng.uniform(0.01, 0.3)]))
+    max_drift = float(rng.choice([0.3, 0.5, rng.uniform(0.1, 1.5)]))
+
+    expected = reference_turning_points(
+        data, min_change=min_change, max_drift=max_drift
+    )
+    actual = compute_turning_points(data, min_change=min_change, max_drift=max_drift)
+    assert actual == expected
+
+
+@pytest.mark.parametrize(
+    "data",
+    [[0.5], [0.5, 0.5], [0.0, 1.0], [0.5] * 50, list(np.linspace(0, 3, 100))],
+)
+def test_matches_reference_on_edge_cases(data):
+    assert compute_turning_points(data) == reference_turning_points(data)
@@ -1,5 +1,7 @@
 import os
+import json
 import subprocess
+import time
 import shutil
 import tempfile
 import re
@@ -11,6 +13,7 @@ import enum
 import requests
 from bs4 import BeautifulSoup
 from yt_dlp import YoutubeDL
+from yt_dlp.utils import download_range_func
 
 TMP_DIR = "/tmp"
 
@@ -172,6 +175,71 @@ def download_youtube_vod(url, resolution=1080, info=None, ext=None, vcodec=None)
     return re.sub(r"\.f\d+", "", youtube_download.filename)
 
 
+def download_youtube_vod_ranges(
+    url, ranges, resolution=1080, info=None, ext=None, vcodec=None, buffer=1
+):
+    """Download only some time ranges of a video, each to its own file.
+
+    yt-dlp fetches every range through ffmpeg, re-encoding around the cuts so every
+    file starts on a keyframe at exactly its start time. Each range is widened by
+    `buffer` seconds on both sides.
+
+    Args:
+        ranges: A list of (start, end) times in seconds.
+
+    Returns:
+        list: A (path, offset) tuple per range, where offset is the time in the video
+        the file starts at, or None for a range that failed to download. None if
+        nothing could be downloaded.
+    """
+    if not info:
+        info = download_youtube_info(url)
+
+    format_ = _get_closest_available_format(
+        info["formats"], resolution=resolution, fps=30, ext=ext, vcodec=vcodec
+    )
+    if not format_:
+        print(f"No available formats less than resolution: {resolution}")
+        return None
+
+    audio_format = _get_highest_quality_audio_format(
+        info["formats"], "m4a" if format_["ext"] == "mp4" else "webm"
+    )
+    if not audio_format:
+        print(f"No available audio formats for: {url}")
+        return None
+
+    sections = [(max(0, start - buffer), end + buffer) for start, end in ranges]
+
+    ydl_opts = {
+        **DEFAULT_YT_DLP_ARGS,
+        "paths": {"home": TMP_DIR},
+        "no_playlist": True,
+        "format": format_["format_id"] + "+" + audio_format["format_id"],
+        "outtmpl": "%(id)s_"
+        + str(uuid4())
+        + "_%(section_start)s-%(section_end)s.%(ext)s",
+        "download_ranges": download_range_func(None, sections),
+        "force_keyframes_at_cuts": True,
+    }
+    with YoutubeDL(ydl_opts) as ydl:
+        download_info = ydl.extract_info(url, download=True)
+
+    # every section is downloaded as its own requested download
+    paths = {
+        download.get("section_start"): download["filepath"]
+        for download in download_info.get("requested_downloads", [])
+        if download.get("filepath") and os.path.isfile(download["filepath"])
+    }
+    if not paths:
+        print(f"No sections downloaded for: {url}")
+        return None
+
+    return [
+        (paths[start], start) if start in paths else None for start, _ in sections
+    ]
+
+
 def _get_highest_quality_audio_format(formats, ext="m4a"):
     return next(
         (
@@ -207,36 +275,21 @@ def extract_clip(path, start, end):
 
     output_path = path.rsplit(".", 1)[0] + "_trimmed" + file_extension
     try:
-        # if file_extension == ".mp4":
+        # seeking on the input jumps straight to the keyframe before start instead of
+        # reading the file from the beginning
         command = [
             "ffmpeg",
-            "-i",
-            path,  # Input file
+            "-y",
             "-ss",
             str(start),  # Start time
-            "-to",
-            str(end),  # End time
+            "-i",
+            path,  # Input file
+            "-t",
+            str(end - start),  # Duration
             "-c",
             "copy",  # Copy the stream directly, no re-encoding
             output_path,  # Output file
         ]
-        # elif file_extension == ".webm":
-        #     command = [
-        #         "ffmpeg",
-        #         "-i",
-        #         path,  # Input file
-        #         "-ss",
-        #         str(start),  # Start time
-        #         "-to",
-        #         str(end),  # End time
-        #         "-c:v",
-        #         "libvpx",  # Video codec for WebM
-        #         "-c:a",
-        #         "libvorbis",  # Audio codec for WebM
-        #         output_path,  # Output file
-        #     ]
-        # else:
-        #     raise ValueError("Unsupported file format")
 
         # Execute the command
         subprocess.run(command, check=True)
@@ -247,67 +300,258 @@ def extract_clip(path, start, end):
         print(e)
 
 
-# this function first does a rough cut without re-encoding and then a precise cut with re-encoding
-def extract_clip_2_step_mp4(path: str, start: int, end: int, buffer=30):
-    file_extension = os.path.splitext(path)[1]
-    intermediate_output_path = (
-        path.rsplit(".", 1)[0] + f"_{int(start)}_{int(end)}" + "_intermediate" + file_extension
-    )
-    final_output_path = (
-        path.rsplit(".", 1)[0] + f"_{int(start)}_{int(end)}" + "_trimmed" + file_extension
+CLIP_ENCODER_ARGS = [
+    "-c:v",
+    "libx264",  # Re-encode video
+    "-preset",
+    "fast",  # Faster encoding preset
+    "-crf",
+    "28",
+]
+
+
+def probe_video_packets(path, start, end):
+    """Probe the first video stream and its packets in between start and end.
+
+    Only packet headers are read, from the keyframe before start onwards, so nothing is
+    decoded.
+
+    Returns:
+        tuple: The stream info as returned by ffprobe and a (time, keyframe) tuple per
+        packet in presentation order, with times relative to the start of the file like
+        ffmpeg's -ss.
+    """
+    command = [
+        "ffprobe",
+        "-v",
+        "error",
+        "-select_streams",
+        "v:0",
+        "-read_intervals",
+        f"{start}%{end}",
+        "-show_entries",
+        "stream=codec_name,pix_fmt:format=start_time:packet=pts_time,flags",
+        "-of",
+        "json",
+        path,
+    ]
+    result = subprocess.run(command, check=True, capture_output=True, text=True)
+    probe = json.loads(result.stdout)
+
+    start_time = float(probe.get("format", {}).get("start_time", 0))
+    packets = sorted(
+        (float(packet["pts_time"]) - start_time, "K" in packet.get("flags", ""))
+        for packet in probe.get("packets", [])
+        if packet.get("pts_time") is not None
     )
+    stream = probe["streams"][0] if probe.get("streams") else {}
+    return stream, [(pts, key) for pts, key in packets if start <= pts <= end]
 
-    # with tempfile.NamedTemporaryFile(suffix=file_extension, delete=True) as temp_file:
-    #     shutil.copy2(path, temp_file.name)
-    #     temp_input_path = temp_file.name
-    try:
-        # Step 1: Fast cut with buffer
 
-        adjusted_start_time = max(0, start - buffer)
-        adjusted_end_time = end + buffer
-        fast_cut_command = [
-            "ffmpeg",
-            "-i",
-            path,  # Input file
-            "-ss",
-            str(adjusted_start_time),  # Start time with buffer
-            "-to",
-            str(adjusted_end_time),  # End time with buffer
-            "-c",
-            "copy",  # Copy the stream directly, no re-encoding
-            intermediate_output_path,  # Intermediate output file
-        ]
-        subprocess.run(fast_cut_command, check=True)
+def _clip_parts(path, start, end, copy_middle, min_copy_seconds):
+    # the (start, end, codec args) of the video parts a clip is concatenated from, or
+    # None if it is encoded in one go
+    if not copy_middle:
+        return None
 
-        # Step 2: Precise cut with re-encoding
-        precise_start_time = buffer if start > buffer else start
-        precise_end_time = precise_start_time + (end - start)
-        precise_cut_command = [
-            "ffmpeg",
-            "-i",
-            intermediate_output_path,  # Intermediate file as input
-            "-ss",
-            str(precise_start_time),  # Adjusted start time for precise cut
-            "-to",
-            str(precise_end_time),  # Adjusted end time for precise cut
-            "-c:v",
-            "libx264",  # Re-encode video
-            "-preset",
-            "fast",  # Faster encoding preset
-            "-crf",
-            "28",
-            "-c:a",
-            "aac",  # Re-encode audio
-            final_output_path,  # Final output file
-        ]
-        subprocess.run(precise_cut_command, check=True)
+    stream, packets = probe_video_packets(path, start, end)
+    keyframes = [pts for pts, key in packets if key]
+    # parameter sets stay in-band, so the re-encoded ends only need to match the codec
+    # and chroma format of the copied middle
+    if (
+        stream.get("codec_name") != "h264"
+        or stream.get("pix_fmt") != "yuv420p"
+        or len(keyframes) < 2
+        or keyframes[-1] - keyframes[0] < min_copy_seconds
+    ):
+        return None
+
+    copy_start, copy_end = keyframes[0], keyframes[-1]
+    # stream copy cuts on decode timestamps, which would let the first frames after the
+    # last keyframe through, so cut on a frame count
+    copy_frames = sum(copy_start <= pts < copy_end for pts, _ in packets)
+    parts = [
+        (start, copy_start, CLIP_ENCODER_ARGS),
+        (copy_start, copy_end, ["-frames:v", str(copy_frames), "-c:v", "copy"]),
+        (copy_end, end, CLIP_ENCODER_ARGS),
+    ]
+    # skip the ends that already start or stop on a keyframe
+    return [part for part in parts if part[1] - part[0] >= 0.001]
+
+
+def extract_clips_mp4(
+    path: str, clips, copy_middle=True, min_copy_seconds=4, on_clip=None, timings=None
+):
+    """Cut several clips out of an H.264 video with frame accurate start and end times.
+
+    A single ffmpeg process cuts every clip, seeking on the input so only the ranges of
+    the clips are read and only the GOP before each of them is decoded. With
+    `copy_middle`, only the partial GOPs at both ends of a clip are re-encoded and its
+    keyframe aligned middle is stream copied, then each clip is muxed with its audio,
+    re-encoded over the whole clip. If the shared pass fails, every clip is cut again
+    on its own, so one bad clip doesn't fail the others.
+
+    Args:
+        clips: A list of (start, end) times in seconds.
+        on_clip: Called with the index and path of every clip as soon as it is done, or
+            with None as its path if it failed.
+        timings (list): Appended a dict per clip with the time it took until the clip
+            was done and how many seconds of it were re-encoded and copied.
+
+    Returns:
+        list: The path of every clip, or None for the clips that failed.
+    """
+    timings = [] if timings is None else timings
+    clip_timings = [
+        {"seconds": 0.0, "copied_seconds": 0.0, "encoded_seconds": end - start}
+        for start, end in clips
+    ]
+    timings.extend(clip_timings)
+    started_at = time.perf_counter()
+
+    base_path, file_extension = path.rsplit(".", 1)[0], os.path.splitext(path)[1]
+    output_paths = [
+        f"{base_path}_{int(start)}_{int(end)}_trimmed{file_extension}"
+        for start, end in clips
+    ]
+    done = [False] * len(clips)
+
+    def finish(index, output_path, extracted_timing=None):
+        done[index] = True
+        output_paths[index] = output_path
+        clip_timing = clip_timings[index]
+        if extracted_timing is not None:
+            # cut on its own, which already reported it
+            clip_timing.update(extracted_timing)
+        else:
+            clip_timing["seconds"] = time.perf_counter() - started_at
+            start, end = clips[index]
+            clip_timing["encoded_seconds"] = end - start - clip_timing["copied_seconds"]
+        if output_path and extracted_timing is None:
+            print(
+                f"Clip extracted successfully to {output_path} in "
+                f"{clip_timing['seconds']:.2f}s, "
+                f"{clip_timing['copied_seconds']:.1f}s copied"
+            )
+        if on_clip:
+            on_clip(index, output_path)
+
+    try:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            command = ["ffmpeg", "-y"]
+            clip_parts = []
+            for index, (start, end) in enumerate(clips):
+                parts = _clip_parts(path, start, end, copy_middle, min_copy_seconds)
+                if parts is None:
+                    command += ["-ss", str(start), "-t", str(end - start), "-i", path]
+                    input_index = command.count("-i") - 1
+                    command += ["-map", f"{input_index}:v:0"]
+                    command += ["-map", f"{input_index}:a:0?", *CLIP_ENCODER_ARGS]
+                    command += ["-c:a", "aac", output_paths[index]]
+                    clip_parts.append(None)
+                    continue
+
+                part_paths = []
+                for part_start, part_end, codec_args in parts:
+                    part_name = f"{index}_{len(part_paths)}.ts"
+                    part_path = os.path.join(temp_dir, part_name)
+                    command += ["-ss", str(part_start)]
+                    command += ["-t", str(part_end - part_start), "-i", path]
+                    input_index = command.count("-i") - 1
+                    # MPEG-TS parts keep their parameter sets in-band and are offset to
+                    # continue each other's timestamps, so they can simply be
+                    # concatenated even though they were encoded differently
+                    command += ["-map", f"{input_index}:v:0", *codec_args]
+                    command += ["-output_ts_offset", str(part_start - start)]
+                    command += ["-f", "mpegts", part_path]
+                    part_paths.append(part_path)
+                    if codec_args[-1] == "copy":
+                        clip_timings[index]["copied_seconds"] += part_end - part_start
+                clip_parts.append(part_paths)
+
+            try:
+                subprocess.run(command, check=True)
+            except subprocess.CalledProcessError as e:
+                if len(clips) == 1:
+                    raise
+                print(f"An error occurred: {e}, extracting the clips one by one")
+                for index, (start, end) in enumerate(clips):
+                    clip_timing = {}
+                    clip_path = extract_clip_mp4(
+                        path,
+                        start,
+                        end,
+                        copy_middle=copy_middle,
+                        min_copy_seconds=min_copy_seconds,
+                        timings=clip_timing,
+                    )
+                    finish(index, clip_path, clip_timing)
+                return output_paths
+
+            for index, part_paths in enumerate(clip_parts):
+                if part_paths is None:
+                    finish(index, output_paths[index])
+                    continue
 
-        print(f"Clip extracted successfully to {final_output_path}")
-        return final_output_path
+                start, end = clips[index]
+                command = [
+                    "ffmpeg",
+                    "-y",
+                    "-f",
+                    "mpegts",
+                    "-i",
+                    "concat:" + "|".join(part_paths),
+                    "-ss",
+                    str(start),
+                    "-i",
+                    path,
+                    "-t",
+                    str(end - start),
+                    "-map",
+                    "0:v:0",
+                    "-map",
+                    "1:a:0?",
+                    "-c:v",
+                    "copy",
+                    "-c:a",
+                    "aac",  # Re-encode audio
+                    output_paths[index],
+                ]
+                try:
+                    subprocess.run(command, check=True)
+                    finish(index, output_paths[index])
+                except subprocess.CalledProcessError as e:
+                    print(f"An error occurred: {e}")
+                    finish(index, None)
     except subprocess.CalledProcessError as e:
         print(f"An error occurred: {e}")
     except ValueError as e:
         print(e)
+    finally:
+        # never leave a caller waiting on a clip
+        for index in range(len(clips)):
+            if not done[index]:
+                finish(index, None)
+
+    return output_paths
+
+
+def extract_clip_mp4(path: str, start: float, end: float, timings=None, **kwargs):
+    """Cut a single clip, see `extract_clips_mp4`.
+
+    Args:
+        timings (dict): Filled in with the timings of the clip.
+
+    Returns:
+        str: The path of the clip, or None if ffmpeg failed.
+    """
+    clip_timings = []
+    clip_path = extract_clips_mp4(
+        path, [(start, end)], timings=clip_timings, **kwargs
+    )[0]
+    if timings is not None:
+        timings.update(clip_timings[0])
+    return clip_path
 
 
 class ValidationResult(enum.Enum):
@@ -1,3 +1,4 @@
+import asyncio
 import boto3
 import os
 from botocore.exceptions import NoCredentialsError
@@ -24,7 +25,8 @@ async def upload_file_to_s3(file_name, object_name=None):
 
     s3_client = create_s3_client()
     try:
-        s3_client.upload_file(file_name, s3_bucket, object_name)
+        # boto3 blocks, so upload on a worker thread to keep the event loop free
+        await asyncio.to_thread(s3_client.upload_file, file_name, s3_bucket, object_name)
         file_url = f"https://{s3_bucket}.s3.{aws_region}.amazonaws.com/{object_name}"
         return file_url
     except NoCredentialsError:
@@ -38,7 +40,9 @@ async def upload_file_obj_to_s3(file_obj, object_name):
 
     s3_client = create_s3_client()
     try:
-        s3_client.upload_fileobj(file_obj, s3_bucket, object_name)
+        await asyncio.to_thread(
+            s3_client.upload_fileobj, file_obj, s3_bucket, object_name
+        )
         file_url = f"https://{s3_bucket}.s3.{aws_region}.amazonaws.com/{object_name}"
         return file_url
     except NoCredentialsError: